@@ -0,0 +1,49 @@
+import os
+import hashlib
+
+import cache
+import decompress
+
+# Data the tools read over and over: font files, and blocks decompressed from the ROM such as the
+# title screen font at 0x50dea. Files are kept in memory until they change. Decompressed blocks
+# are keyed by a hash of the ROM and the offset, and kept both in memory and in the persistent
+# cache (see cache.py), so they're only decompressed once for a given ROM.
+
+_files = {} # path -> (modification time, size, data)
+_hashes = {} # path -> (modification time, size, hash)
+_blocks = cache.MemoryCache(cache.DiskCache('assets'), max_entries=32)
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def read_file(path):
+    """The contents of path, read again only if the file has changed."""
+    stamp = _stamp(path)
+    cached = _files.get(path)
+    if cached is None or cached[:2] != stamp:
+        with open(path, 'rb') as f:
+            cached = _files[path] = stamp + (f.read(),)
+    return cached[2]
+
+def file_hash(path):
+    """The SHA-256 of path, worked out again only if the file has changed."""
+    stamp = _stamp(path)
+    cached = _hashes.get(path)
+    if cached is None or cached[:2] != stamp:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        cached = _hashes[path] = stamp + (h.hexdigest(),)
+    return cached[2]
+
+def decompressed(rom_path, offset):
+    """The decompressed block at offset in rom_path. Raises ValueError if there isn't a valid block there."""
+    key = cache.make_key('decompressed', file_hash(rom_path), offset)
+    data = _blocks.get(key)
+    if data is None:
+        with decompress.open_rom(rom_path) as rom:
+            data = bytes(decompress.decompress(rom, offset)[0])
+        _blocks.put(key, data)
+    return data
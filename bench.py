@@ -0,0 +1,173 @@
+import sys
+import os
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+import compress
+import decompress
+import encode
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def synthetic_tiles(count, seed):
+    # 4bpp tile sets: a small pool of distinct tiles repeated, most pixels transparent.
+    r = random.Random(seed)
+    pool = [bytes(r.choice((0x00, 0x00, 0x00, 0x11, 0x12, 0x21, 0x22, 0xf0, 0x0f)) for _ in range(32))
+            for _ in range(max(1, count // 4))]
+    return b''.join(r.choice(pool) for _ in range(count))
+
+def corpus():
+    """The fixed benchmark inputs as (name, bytes) pairs. Always the same for the same tree."""
+    inputs = []
+    for language in ('en', 'es'):
+        directory = os.path.join(REPO_DIR, language)
+        for name in sorted(os.listdir(directory)):
+            if name.startswith('intro') and name.endswith('.txt'):
+                lines = encode.read_text_lines(os.path.join(directory, name))
+                inputs.append((name[:-4], encode.encode_tilemap(lines).to_bytes()))
+    with open(os.path.join(REPO_DIR, 'es', 'menu.bin'), 'rb') as f:
+        inputs.append(('menu', f.read()))
+    inputs.append(('tiles_8k', synthetic_tiles(256, 1)))
+    inputs.append(('tiles_32k', synthetic_tiles(1024, 2)))
+    inputs.append(('fill_8k', bytes(8192)))
+    inputs.append(('random_4k', random.Random(3).randbytes(4096)))
+    inputs.append(('repetitive_8k', (b'DUNGEONS&DRAGONS' * 512)))
+    return inputs
+
+MODES = {
+    'greedy': {'minimum_span': compress.MINIMUM_SPAN},
+    'optimal': {'minimum_span': compress.MINIMUM_SPAN, 'optimal': True},
+    'tilemap': {'minimum_span': compress.MINIMUM_SPAN, 'tilemap': True},
+}
+
+def measure(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # Peak memory in a separate run, tracemalloc slows everything down.
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+def run_benchmarks(modes, repeat=3):
+    results = {}
+    for name, data in corpus():
+        for mode in modes:
+            compressed_data, seconds, peak = measure(lambda: compress.compress_optimal(data, **MODES[mode]), repeat)
+            results[f"compress/{mode}/{name}"] = {
+                'input_size': len(data),
+                'output_size': len(compressed_data),
+                'seconds': seconds,
+                'bytes_per_second': len(data) / seconds if seconds else None,
+                'peak_memory': peak,
+            }
+        compressed_data = bytes(compress.compress_optimal(data, **MODES['optimal']))
+        (decompressed, _), seconds, peak = measure(lambda: decompress.decompress(compressed_data), repeat)
+        if decompressed != data:
+            raise ValueError(f"{name} does not round trip.")
+        results[f"decompress/{name}"] = {
+            'input_size': len(compressed_data),
+            'output_size': len(decompressed),
+            'seconds': seconds,
+            'bytes_per_second': len(decompressed) / seconds if seconds else None,
+            'peak_memory': peak,
+        }
+    return results
+
+SCALING_SIZES = (0x1000, 0x2000, 0x4000, 0x8000, 0x10000)
+
+def run_scaling(modes, repeat=1):
+    """Compresses tile sets of each of SCALING_SIZES, to show how time and peak memory grow with the input."""
+    results = {}
+    for size in SCALING_SIZES:
+        data = synthetic_tiles(size // 32, size)
+        for mode in modes:
+            compressed_data, seconds, peak = measure(lambda: compress.compress_optimal(data, **MODES[mode]), repeat)
+            results[f"scaling/{mode}/{size}"] = {
+                'input_size': size,
+                'output_size': len(compressed_data),
+                'seconds': seconds,
+                'bytes_per_second': size / seconds if seconds else None,
+                'peak_memory': peak,
+            }
+    return results
+
+def print_scaling(results):
+    # Both columns should stay roughly flat as the input grows.
+    print(f"{'benchmark':<34} {'us/byte':>8} {'peak bytes/byte':>16}")
+    for key, r in results.items():
+        print(f"{key:<34} {r['seconds'] * 1e6 / r['input_size']:8.1f} {r['peak_memory'] / r['input_size']:16.1f}")
+
+def compare(baseline, results, time_tolerance, memory_tolerance):
+    """
+    Returns a list of regressions: any larger compressed output, or time or peak memory
+    worse than the baseline by more than the tolerance (a fraction, 0.25 is 25%).
+    """
+    regressions = []
+    for key, new in sorted(results.items()):
+        old = baseline.get(key)
+        if old is None:
+            continue
+        if key.startswith('compress/') and new['output_size'] > old['output_size']:
+            regressions.append(f"{key}: output {old['output_size']} -> {new['output_size']} bytes")
+        if new['seconds'] > old['seconds'] * (1 + time_tolerance):
+            regressions.append(f"{key}: time {old['seconds'] * 1000:.2f} -> {new['seconds'] * 1000:.2f} ms")
+        if new['peak_memory'] > old['peak_memory'] * (1 + memory_tolerance):
+            regressions.append(f"{key}: peak memory {old['peak_memory']} -> {new['peak_memory']} bytes")
+    return regressions
+
+def print_results(results):
+    print(f"{'benchmark':<34} {'in':>7} {'out':>7} {'ms':>9} {'KB/s':>9} {'peak KB':>8}")
+    for key, r in results.items():
+        rate = f"{r['bytes_per_second'] / 1024:9.0f}" if r['bytes_per_second'] else f"{'-':>9}"
+        print(f"{key:<34} {r['input_size']:7} {r['output_size']:7} {r['seconds'] * 1000:9.2f} {rate} {r['peak_memory'] / 1024:8.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark compress.py and decompress.py on a fixed corpus.",
+                                     epilog="Example: python bench.py -o baseline.json; python bench.py --compare baseline.json")
+    parser.add_argument('-o', '--output', help="save the results as JSON")
+    parser.add_argument('--compare', metavar='BASELINE', help="flag regressions against saved results")
+    parser.add_argument('--modes', default='greedy,optimal', help="compression modes to run (default greedy,optimal)")
+    parser.add_argument('--scaling', action='store_true',
+                        help="instead of the corpus, compress tile sets from 4 KB to 64 KB and show time and memory per byte")
+    parser.add_argument('--repeat', type=int, default=3, help="timing runs per benchmark, the fastest counts")
+    parser.add_argument('--time-tolerance', type=float, default=0.25, help="allowed slowdown before flagging (default 0.25)")
+    parser.add_argument('--memory-tolerance', type=float, default=0.10, help="allowed memory growth before flagging (default 0.10)")
+    args = parser.parse_args()
+
+    modes = args.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"Unknown mode '{mode}', choose from {', '.join(MODES)}.")
+
+    if args.scaling:
+        results = run_scaling(modes, args.repeat)
+        print_results(results)
+        print()
+        print_scaling(results)
+    else:
+        results = run_benchmarks(modes, args.repeat)
+        print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote results to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.time_tolerance, args.memory_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions.")
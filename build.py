@@ -0,0 +1,278 @@
+import sys
+import os
+import copy
+import json
+import mmap
+import time
+import argparse
+
+import assets
+import cache
+import compress
+import decompress
+import encode
+import sprite
+
+TOOLS = ('encode', 'compress', 'sprite-tiles', 'sprite-table')
+
+def read_build_manifest(filename):
+    """
+    Reads a build manifest (see build.txt). Returns a list of (source, tool, offset, budget)
+    tuples, with budget None for "auto". Sources are relative to the manifest's directory.
+    """
+    base = os.path.dirname(os.path.abspath(filename))
+    entries = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields or fields[0] == 'free':
+                continue
+            if len(fields) != 4 or fields[1] not in TOOLS:
+                raise ValueError(f"{filename}:{line_number}: expected '<source> <tool> <offset> <budget>' with tool one of {', '.join(TOOLS)}")
+            budget = None if fields[3] == 'auto' else int(fields[3], 16)
+            entries.append((os.path.join(base, fields[0]), fields[1], int(fields[2], 16), budget))
+    return entries
+
+def read_free_regions(filename):
+    """Returns the (start, end) of each "free <start> <end>" line in a build manifest."""
+    regions = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields or fields[0] != 'free':
+                continue
+            if len(fields) != 3:
+                raise ValueError(f"{filename}:{line_number}: expected 'free <start> <end>'")
+            start, end = int(fields[1], 16), int(fields[2], 16)
+            if end <= start:
+                raise ValueError(f"{filename}:{line_number}: free region ends before it starts")
+            regions.append((start, end))
+    return regions
+
+def tool_version(tool):
+    if tool == 'encode':
+        return (encode.ENCODER_VERSION, compress.COMPRESSOR_VERSION)
+    if tool == 'sprite-tiles':
+        return (sprite.SPRITE_VERSION, compress.COMPRESSOR_VERSION)
+    if tool == 'sprite-table':
+        return (sprite.SPRITE_VERSION,)
+    return (compress.COMPRESSOR_VERSION,)
+
+def dependencies(source, tool):
+    # The game over text names its font file, which is as much a source as the text itself.
+    deps = [source]
+    if tool.startswith('sprite'):
+        with open(source, 'r') as f:
+            sprite.generate_sprite_table_and_tiles_flexible_spaces(f.read(), verbose=False)
+        if sprite.filename is None:
+            raise ValueError(f"{source} has no @filename directive naming its font.")
+        deps.append(sprite.filename)
+    return deps
+
+def compress_block(data, output_cache):
+    compressed_data, _ = compress.compress_cached(data, {'minimum_span': compress.MINIMUM_SPAN, 'optimal': True},
+                                                  output_cache)
+    return bytes(compressed_data)
+
+def build_entry(source, tool, output_cache):
+    """Runs the tool for one manifest entry and returns the bytes to put in the ROM."""
+    if tool == 'encode':
+        tilemap = encode.encode_tilemap(encode.read_text_lines(source))
+        return compress_block(tilemap.to_bytes(), output_cache)
+    if tool == 'compress':
+        with open(source, 'rb') as f:
+            return compress_block(f.read(), output_cache)
+
+    with open(source, 'r') as f:
+        sprite_entries, tiles_needed_string = sprite.generate_sprite_table_and_tiles_flexible_spaces(f.read(), verbose=False)
+    if len(tiles_needed_string) > 93 or len(sprite_entries) > 28:
+        raise ValueError(f"{len(tiles_needed_string)} tiles and {len(sprite_entries)} sprites, the limits are 93 and 28.")
+    if tool == 'sprite-table':
+        return sprite.sprite_table_bytes(sprite_entries)
+    tileset = sprite.build_tileset(tiles_needed_string, sprite.load_font(), sprite.fontorder, sprite.fontoffset)
+    return compress_block(tileset, output_cache)
+
+def load_state(state_path):
+    try:
+        with open(state_path, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {'original_sizes': {}, 'entries': {}}
+
+def save_state(state_path, state):
+    with open(state_path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+def entry_budget(rom, state, name, offset, budget):
+    # An "auto" budget is the size of the original block, measured once and kept in the state.
+    if budget is not None:
+        return budget
+    original = state['original_sizes'].get(f"0x{offset:x}")
+    if original is None:
+        measured = decompress.measure(rom, offset)
+        if measured is None:
+            raise ValueError(f"{name}: no compressed block at 0x{offset:x} to take the budget from.")
+        original = measured[1]
+        state['original_sizes'][f"0x{offset:x}"] = original
+    return original
+
+def build_blocks(entries, rom, state, build_dir, force=False, output_cache=None, save=True):
+    """
+    Builds every manifest entry whose sources or tools changed since the last build.
+    Returns (list of (name, offset, budget, data), number rebuilt). With save False, rebuilt
+    blocks are only kept in memory: nothing is written to build_dir and state isn't updated.
+    """
+    blocks = []
+    rebuilt = 0
+    for source, tool, offset, budget in entries:
+        name = f"{os.path.basename(source)}.{tool}.0x{offset:x}"
+        output_path = os.path.join(build_dir, name + '.bin')
+
+        budget = entry_budget(rom, state, name, offset, budget)
+        key = [assets.file_hash(dep) for dep in dependencies(source, tool)] + list(tool_version(tool))
+        previous = state['entries'].get(name)
+        if not force and previous and previous['key'] == key and os.path.exists(output_path):
+            with open(output_path, 'rb') as f_in:
+                data = f_in.read()
+        else:
+            data = build_entry(source, tool, output_cache)
+            if save:
+                with open(output_path, 'wb') as f_out:
+                    f_out.write(data)
+                state['entries'][name] = {'key': key, 'size': len(data)}
+            rebuilt += 1
+            print(f"Built {name}: {len(data)} bytes (budget {budget})")
+        blocks.append((name, offset, budget, data))
+    return blocks, rebuilt
+
+def build(manifest, rom_path, build_dir, force=False, output_cache=None, relocate=False):
+    """
+    Builds every manifest entry whose sources or tools changed since the last build, checks each
+    block against its budget and patches the ROM in place. Stops at the first block that doesn't
+    fit, before anything is written. With relocate, blocks that don't fit are moved to free space
+    instead (see pack.py) and the pointers to them are updated. Returns the number of blocks rebuilt.
+    """
+    entries = read_build_manifest(manifest)
+    os.makedirs(build_dir, exist_ok=True)
+    state_path = os.path.join(build_dir, 'state.json')
+    state = load_state(state_path)
+
+    with open(rom_path, 'r+b') as f, mmap.mmap(f.fileno(), 0) as rom:
+        blocks, rebuilt = build_blocks(entries, rom, state, build_dir, force, output_cache)
+
+        pointers = []
+        if relocate:
+            import pack
+            # Planned on a copy, so a plan that fails leaves the saved placements as they were.
+            pack_state = copy.deepcopy(state.get('pack', {}))
+            try:
+                placements, pointers = pack.plan(blocks, read_free_regions(manifest), pack_state, rom)
+            except ValueError:
+                save_state(state_path, state)
+                raise
+            state['pack'] = pack_state
+            pack.print_plan(blocks, placements, pack_state)
+        else:
+            for name, offset, budget, data in blocks:
+                if len(data) > budget:
+                    save_state(state_path, state)
+                    raise ValueError(f"{name} is {len(data)} (0x{len(data):x}) bytes, {len(data) - budget} over its budget of {budget} (0x{budget:x}).")
+            placements = {name: offset for name, offset, _, _ in blocks}
+
+        patched = 0
+        for name, _, _, data in blocks:
+            offset = placements[name]
+            if rom[offset:offset+len(data)] != data:
+                rom[offset:offset+len(data)] = data
+                patched += 1
+        for position, value in pointers:
+            rom[position:position+4] = value
+        rom.flush()
+
+    save_state(state_path, state)
+    moved = f" and {len(pointers)} pointers updated" if pointers else ""
+    print(f"{rebuilt} of {len(entries)} blocks rebuilt, {patched} patched{moved} into {rom_path}.")
+    return rebuilt
+
+def watch(manifest, rom_path, build_dir, interval=0.5, output_cache=None):
+    """
+    Checks the manifest's sources every interval seconds and, when one changes, builds just the
+    entries that use it and prints their size against their budget. Nothing is written to the
+    ROM. Runs until interrupted.
+    """
+    entries = read_build_manifest(manifest)
+    os.makedirs(build_dir, exist_ok=True)
+    state_path = os.path.join(build_dir, 'state.json')
+    state = load_state(state_path)
+    with open(rom_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as rom:
+        budgets = [entry_budget(rom, state, os.path.basename(source), offset, budget)
+                   for source, _, offset, budget in entries]
+    save_state(state_path, state)
+    print(f"Watching {len(entries)} blocks from {manifest}. Press Ctrl-C to stop.")
+    try:
+        watch_loop(entries, budgets, interval, output_cache)
+    except KeyboardInterrupt:
+        print()
+
+def watch_loop(entries, budgets, interval, output_cache):
+    stamps = {} # entry -> modification times of its dependencies when last built
+    deps = {}
+    missing = {} # entry -> the error last printed for a file that couldn't be read
+    while True:
+        for entry, budget in zip(entries, budgets):
+            source, tool, offset, _ = entry
+            previous = stamps.get(entry)
+            try:
+                if previous is None or os.stat(source).st_mtime_ns != previous[0]:
+                    try:
+                        deps[entry] = dependencies(source, tool)
+                    except ValueError:
+                        deps[entry] = [source] # The build below reports it
+                stamp = [os.stat(dep).st_mtime_ns for dep in deps[entry]]
+            except OSError as e:
+                # Missing, or an editor is halfway through saving it; try again on the next check.
+                stamps[entry] = None
+                if missing.get(entry) != str(e):
+                    missing[entry] = str(e)
+                    print(f"{os.path.basename(source)} {tool}: {e}")
+                continue
+            missing.pop(entry, None)
+            if stamp == previous:
+                continue
+            # A block that fails to build is only tried again when one of its files changes.
+            stamps[entry] = stamp
+            start = time.perf_counter()
+            try:
+                size = len(build_entry(source, tool, output_cache))
+            except (IOError, ValueError) as e:
+                print(f"{time.strftime('%H:%M:%S')} {os.path.basename(source)} {tool}: {e}")
+                continue
+            elapsed = time.perf_counter() - start
+            fits = f"{budget - size} spare" if size <= budget else f"{size - budget} OVER"
+            print(f"{time.strftime('%H:%M:%S')} {os.path.basename(source)} {tool} 0x{offset:x}: "
+                  f"{size} of {budget} bytes, {fits} ({elapsed * 1000:.0f} ms)")
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build every translated block and patch it into the ROM.",
+                                     epilog="Example: python build.py dnd.md")
+    parser.add_argument('rom_path')
+    parser.add_argument('manifest', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build.txt'))
+    parser.add_argument('--build-dir', default='build', help="where built blocks and the build state are kept")
+    parser.add_argument('--force', action='store_true', help="rebuild everything")
+    parser.add_argument('--relocate', action='store_true',
+                        help="move blocks that are over budget to free space and update their pointers (see pack.py)")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and report each block's size against its budget whenever a source changes")
+    parser.add_argument('--interval', type=float, default=0.5, help="seconds between checks with --watch")
+    args = parser.parse_args()
+
+    try:
+        if args.watch:
+            watch(args.manifest, args.rom_path, args.build_dir, args.interval,
+                  cache.MemoryCache(cache.DiskCache('compressed')))
+        else:
+            build(args.manifest, args.rom_path, args.build_dir, args.force, cache.DiskCache('compressed'), args.relocate)
+    except (IOError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
@@ -0,0 +1,155 @@
+import os
+import time
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+# Persistent cache for expensive results (compressed blocks, decompressed assets) keyed by a hash
+# of everything that went into them. Entries are plain files; the least recently used ones are
+# removed once the cache grows past its size limit. MemoryCache keeps recent entries in the
+# process as well, for tools that run for a while and look up the same things again.
+
+DEFAULT_DIRECTORY = os.environ.get('DND_TOOLS_CACHE',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'dnd_game_tools'))
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+def make_key(*parts):
+    """Hashes the parts (bytes or anything with a stable str()) into a cache key."""
+    h = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, (bytes, bytearray, memoryview)):
+            part = repr(part).encode('utf-8')
+        h.update(len(part).to_bytes(8, 'little'))
+        h.update(part)
+    return h.hexdigest()
+
+class DiskCache:
+    def __init__(self, namespace, directory=None, max_size=DEFAULT_MAX_SIZE):
+        self.directory = os.path.join(directory or DEFAULT_DIRECTORY, namespace)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+        except IOError:
+            self.misses += 1
+            return None
+        # The modification time doubles as the last use for eviction.
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary file first so a reader never sees half an entry.
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self.path(key))
+        except OSError:
+            return # A cache that can't be written is just a slower build.
+        self.evict()
+
+    def entries(self):
+        """Returns (key, size, last use) for every entry, least recently used first."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if name.startswith('.tmp'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((name, st.st_size, st.st_mtime))
+        entries.sort(key=lambda e: e[2])
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(self.path(key))
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        removed = 0
+        for key, _, _ in self.entries():
+            try:
+                os.remove(self.path(key))
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def info(self):
+        entries = self.entries()
+        lines = [f"Cache directory: {self.directory}",
+                 f"Entries: {len(entries)}",
+                 f"Size: {sum(size for _, size, _ in entries)} of {self.max_size} bytes"]
+        if entries:
+            lines.append(f"Oldest use: {time.ctime(entries[0][2])}")
+            lines.append(f"Newest use: {time.ctime(entries[-1][2])}")
+        return '\n'.join(lines)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if not lookups:
+            return "Cache: no lookups"
+        return f"Cache: {self.hits} of {lookups} hits ({100 * self.hits / lookups:.0f}%)"
+
+class MemoryCache:
+    """The most recently used entries in memory, in front of another cache (such as a DiskCache) or none."""
+    def __init__(self, backing=None, max_entries=256):
+        self.backing = backing
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        data = self.data.get(key)
+        if data is not None:
+            self.data.move_to_end(key)
+            self.hits += 1
+            return data
+        self.misses += 1
+        data = self.backing.get(key) if self.backing is not None else None
+        if data is not None:
+            self.remember(key, data)
+        return data
+
+    def put(self, key, data):
+        self.remember(key, data)
+        if self.backing is not None:
+            self.backing.put(key, data)
+
+    def remember(self, key, data):
+        self.data[key] = data
+        self.data.move_to_end(key)
+        while len(self.data) > self.max_entries:
+            self.data.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if not lookups:
+            return "Cache: no lookups"
+        return f"Cache: {self.hits} of {lookups} in memory ({100 * self.hits / lookups:.0f}%)"
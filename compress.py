@@ -1,102 +1,467 @@
 import sys
+import os
+import json
+import time
 import struct
+import bisect
+import argparse
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cache
+import cycles
+import decompress
 
 # --- Configuration ---
+# Bump whenever a change alters the output for the same input and settings, so cached results are not reused.
+COMPRESSOR_VERSION = 1
 MINIMUM_SPAN = 3
 MAX_RELATIVE_OFFSET = 0x0fff
 MAX_RELATIVE_LENGTH = 0x07+3
 MAX_ABSOLUTE_LENGTH = 0x3d+3
 MAX_RAW_LENGTH = 0x3F # 63 bytes
+MAX_FILL_LENGTH = 0xffff
+MAX_LONG_LENGTH = 0xffff
+# Absolute and long copies store a 16 bit source position, so larger inputs can't be addressed.
+MAX_INPUT_SIZE = 0x10000
 # Max relative length is 10 bytes
 
 def compress_fill(input_bytes, i):
     length = 1
     value = input_bytes[i]
-    for b in input_bytes[i+1:]:
-        if value != b:
-            break
+    end = min(len(input_bytes), i + MAX_FILL_LENGTH)
+    while i + length < end and input_bytes[i + length] == value:
         length += 1
     if length < 4:
         return []
     return [[[0xfe, length & 0xff, length >> 8, value], length]]
 
-def compress_copy(input_bytes, i):
-    best_short = [[], 0]
-    best_long = [[], 0]
-    for index in range(0,i):
-        if input_bytes[index] == input_bytes[i]:
-            buffer = list(input_bytes[0:i])
-            j = i
-            k = index
-            length = 0
-            while (j < len(input_bytes)) and (input_bytes[j] == buffer[k]):
-                length += 1
-                buffer.append(input_bytes[j])
-                j += 1
-                k += 1
+# The tables below have an entry per input byte, so they are arrays of machine integers rather
+# than lists of Python ints, which take five times the memory or more.
+def suffix_array(data):
+    # Prefix doubling: sort suffixes by their first k bytes, then 2k, and so on
+    # until every suffix has a distinct rank. Each round sorts plain integers that pack the
+    # sort key and the position together, the one list of n Python ints it needs.
+    n = len(data)
+    if n == 0:
+        return array('i')
+    rank = array('i', list(data))
+    scale = max(n, 256) + 2
+    k = 1
+    while True:
+        second = rank[k:] + array('i', [-1]) * min(k, n)
+        order = [(r * scale + s + 1) * n + i for i, (r, s) in enumerate(zip(rank, second))]
+        del second
+        order.sort()
+        r = 0
+        previous = order[0] // n
+        for packed in order:
+            key, index = divmod(packed, n)
+            if key != previous:
+                r += 1
+                previous = key
+            rank[index] = r
+        if r == n - 1 or k >= n:
+            return array('i', (packed % n for packed in order))
+        del order
+        k <<= 1
+
+def lcp_array(data, sa):
+    # Kasai's algorithm. lcp[r] is the common prefix of the suffixes at ranks r-1 and r.
+    n = len(data)
+    rank = array('i', bytes(4 * n))
+    for r, index in enumerate(sa):
+        rank[index] = r
+    lcp = array('i', bytes(4 * n))
+    h = 0
+    for i in range(n):
+        r = rank[i]
+        if r == 0:
+            h = 0
+            continue
+        j = sa[r - 1]
+        while i + h < n and j + h < n and data[i + h] == data[j + h]:
+            h += 1
+        lcp[r] = h
+        if h:
+            h -= 1
+    return lcp
+
+class MatchFinder:
+    # Longest previous match for every position of the input, built once per buffer.
+    #
+    # match_len[i] is the length of the longest match between the bytes at i and
+    # the bytes at any earlier position (the copy may run into i itself, just as
+    # the decompressor allows) and match_pos[i] is one earlier position achieving it.
+    #
+    # Among the earlier positions, the best match for a suffix is always its nearest
+    # neighbour in suffix array order, so a single stack pass over the suffix array
+    # finds them all (the "longest previous factor" array).
+    def __init__(self, input_bytes):
+        self.data = bytes(input_bytes)
+        n = len(self.data)
+        sa = suffix_array(self.data)
+        lcp = lcp_array(self.data, sa)
+        self.match_len = match_len = array('i', bytes(4 * n))
+        self.match_pos = match_pos = array('i', [-1]) * n
+
+        # stack holds ranks with increasing positions; below[r] is the common prefix
+        # between rank r and the rank under it on the stack.
+        stack = []
+        below = array('i', bytes(4 * n))
+        for r in range(n):
+            index = sa[r]
+            common = lcp[r]
+            while stack and sa[stack[-1]] > index:
+                top = stack.pop()
+                # The nearest earlier suffix on the right of top is rank r, and on the left
+                # it is the new top of the stack.
+                if common > below[top]:
+                    match_len[sa[top]] = common
+                    match_pos[sa[top]] = index
+                elif stack:
+                    match_len[sa[top]] = below[top]
+                    match_pos[sa[top]] = sa[stack[-1]]
+                common = min(common, below[top])
+            below[r] = common if stack else 0
+            stack.append(r)
+        while stack:
+            top = stack.pop()
+            if stack:
+                match_len[sa[top]] = below[top]
+                match_pos[sa[top]] = sa[stack[-1]]
+
+        del sa, lcp, below, stack
+
+        # run_len[i] is the number of times the byte at i repeats from i onwards.
+        self.run_len = run_len = array('i', [1]) * n
+        for i in range(n - 2, -1, -1):
+            if self.data[i] == self.data[i + 1]:
+                run_len[i] = run_len[i + 1] + 1
+
+        self.rel_len = None
+        self.rel_pos = None
+
+    def relative_matches(self):
+        # Longest match (up to MAX_RELATIVE_LENGTH) whose source is inside the relative window.
+        # Usually the overall longest match already is, otherwise fall back to a binary search
+        # over the few possible lengths with bytes.rfind limited to the window.
+        if self.rel_len is not None:
+            return self.rel_len, self.rel_pos
+        data = self.data
+        n = len(data)
+        self.rel_len = rel_len = array('i', bytes(4 * n))
+        self.rel_pos = rel_pos = array('i', [-1]) * n
+        for i in range(n):
+            length = min(self.match_len[i], MAX_RELATIVE_LENGTH)
             if length < MINIMUM_SPAN:
-                continue # do nothing
-            if length > MAX_ABSOLUTE_LENGTH:
-                if length > best_long[1]:
-                    best_long = [[0xff, length & 0xff, length >> 8, index & 0xff, index >> 8], length]
-            # Long copy is long. Specifically, it is two bytes longer than the normal absolute copy.
-            # This means there is an edge case at MAX_RELATVIE_LENGTH + 1 where it is not optimal.
-            # Return a short/medium copy as well and let the caller decide between them.
-            length = min(length, MAX_ABSOLUTE_LENGTH)
-            if length > best_short[1]:
-                # The two absolute offset copies have a 16 bit offset but the relative copy can only store 12 bits.
-                # Relative copies cannot look backwards more than 4096 bytes.
-                relative_offset = i - index
-                if (length <= MAX_RELATIVE_LENGTH) and (relative_offset < 0x1000):
-                    best_short = [[((length-3)<<4) | ((i - index) >> 8), ((i - index) & 0xff)], length]
+                continue
+            if i - self.match_pos[i] <= MAX_RELATIVE_OFFSET:
+                rel_len[i] = length
+                rel_pos[i] = self.match_pos[i]
+                continue
+            window = max(0, i - MAX_RELATIVE_OFFSET)
+            pos = data.rfind(data[i:i+MINIMUM_SPAN], window, i + MINIMUM_SPAN - 1)
+            if pos < 0:
+                continue
+            low, high = MINIMUM_SPAN, length
+            while low < high:
+                mid = (low + high + 1) // 2
+                found = data.rfind(data[i:i+mid], window, i + mid - 1)
+                if found < 0:
+                    high = mid - 1
                 else:
-                    best_short = [[0xc0 | length - 3, index & 0xff, index >> 8], length]
-    ret = []
-    if best_long[1] != 0:
-        ret.append(best_long)
-    if best_short[1] != 0:
-        ret.append(best_short)
-    return ret
+                    low, pos = mid, found
+            rel_len[i] = low
+            rel_pos[i] = pos
+        return rel_len, rel_pos
+
+    def earliest(self, i, length):
+        # The lowest earlier position matching at least length bytes at i.
+        return self.data.find(self.data[i:i+length], 0, i + length - 1)
+
+    def fills(self, i):
+        # Same as compress_fill, from the run table.
+        length = min(self.run_len[i], MAX_FILL_LENGTH)
+        if length < 4:
+            return []
+        return [[[0xfe, length & 0xff, length >> 8, self.data[i]], length]]
+
+    def copies(self, i, minimum_span=MINIMUM_SPAN, prefer_relative=False):
+        # Same candidates as a full scan of every earlier index: the best long copy and
+        # the best short/medium copy, each at the earliest index reaching its length.
+        # With prefer_relative a short copy uses any source inside the relative window
+        # that is as long as the earliest one, saving a byte over an absolute copy.
+        length = min(self.match_len[i], MAX_LONG_LENGTH)
+        if length < minimum_span:
+            return []
+        ret = []
+        if length > MAX_ABSOLUTE_LENGTH:
+            index = self.earliest(i, length)
+            ret.append([[0xff, length & 0xff, length >> 8, index & 0xff, index >> 8], length])
+        # Long copy is long. Specifically, it is two bytes longer than the normal absolute copy.
+        # This means there is an edge case at MAX_RELATVIE_LENGTH + 1 where it is not optimal.
+        # Return a short/medium copy as well and let the caller decide between them.
+        length = min(length, MAX_ABSOLUTE_LENGTH)
+        index = self.earliest(i, length)
+        # The two absolute offset copies have a 16 bit offset but the relative copy can only store 12 bits.
+        # Relative copies cannot look backwards more than 4096 bytes.
+        relative_offset = i - index
+        if prefer_relative and length <= MAX_RELATIVE_LENGTH and relative_offset > MAX_RELATIVE_OFFSET:
+            rel_len, rel_pos = self.relative_matches()
+            if rel_len[i] >= length:
+                relative_offset = i - rel_pos[i]
+        if (length <= MAX_RELATIVE_LENGTH) and (relative_offset <= MAX_RELATIVE_OFFSET):
+            ret.append([[((length-3)<<4) | (relative_offset >> 8), relative_offset & 0xff], length])
+        else:
+            ret.append([[0xc0 | length - 3, index & 0xff, index >> 8], length])
+        return ret
+
+# Tilemaps are rows of 64 big-endian words, so most good matches start on a word boundary and
+# come from the same place one or a few rows up, or from the last time the same word appeared.
+ROW_STRIDE = 0x80
+TILEMAP_DISTANCES = (1, 2, ROW_STRIDE, 2 * ROW_STRIDE, 3 * ROW_STRIDE, 4 * ROW_STRIDE)
+TILEMAP_RECENT_WORDS = 3
+# Bytes the fallback searches may scan before it's cheaper to build a MatchFinder for them.
+FALLBACK_SCAN_LIMIT = 1 << 22
+
+def gallop(matches, low, limit):
+    # The largest length from low up to limit for which matches(length) holds, given that it
+    # holds for low. Doubles first, as most matches are short, then searches by halves.
+    high = low
+    while high < limit:
+        high = min(max(2 * high, 1), limit)
+        if not matches(high):
+            break
+        low = high
+    else:
+        return low
+    while low < high - 1:
+        mid = (low + high) // 2
+        if matches(mid):
+            low = mid
+        else:
+            high = mid
+    return low
+
+class TilemapMatcher:
+    # Stands in for MatchFinder in the greedy parse for tilemaps. Instead of building tables for
+    # every position up front it only looks at the positions the parse visits, and there it
+    # tries the structured candidates first: the same word a few rows up, the previous word and
+    # byte, and the last few places the same word appeared. The full search (rfind over
+    # everything before i) only runs where none of them gave a copy worth more than
+    # fallback_below bytes. On data without much structure that is nearly everywhere, so after
+    # a while the fallback builds a MatchFinder and looks its matches up there instead.
+    def __init__(self, input_bytes, fallback_below=MAX_RELATIVE_LENGTH):
+        self.data = bytes(input_bytes)
+        self.fallback_below = fallback_below
+        self.fallbacks = 0
+        self.finder = None
+        self.word_positions = {}
+        for p in range(0, len(self.data) - 1, 2):
+            self.word_positions.setdefault(self.data[p:p+2], []).append(p)
+
+    def fills(self, i):
+        chunk = self.data[i:i+MAX_FILL_LENGTH]
+        length = len(chunk) - len(chunk.lstrip(chunk[:1]))
+        if length < 4:
+            return []
+        return [[[0xfe, length & 0xff, length >> 8, chunk[0]], length]]
+
+    def candidates(self, i):
+        sources = [i - d for d in TILEMAP_DISTANCES if d <= i]
+        if i % 2 == 0:
+            positions = self.word_positions.get(self.data[i:i+2], [])
+            before = bisect.bisect_left(positions, i)
+            sources.extend(positions[max(0, before - TILEMAP_RECENT_WORDS):before])
+        return sources
+
+    def longest(self, i, limit):
+        # The full search: the latest earlier position with the longest match.
+        data = self.data
+        if self.finder is None and self.fallbacks * len(data) > FALLBACK_SCAN_LIMIT:
+            self.finder = MatchFinder(data)
+        if self.finder is not None:
+            return min(self.finder.match_len[i], limit), self.finder.match_pos[i]
+        pos = data.rfind(data[i:i+MINIMUM_SPAN], 0, i + MINIMUM_SPAN - 1)
+        if pos < 0:
+            return 0, -1
+        length = gallop(lambda n: data.rfind(data[i:i+n], 0, i + n - 1) >= 0, MINIMUM_SPAN, limit)
+        return length, data.rfind(data[i:i+length], 0, i + length - 1)
+
+    def copies(self, i, minimum_span=MINIMUM_SPAN, prefer_relative=False):
+        # Every kind of copy that fits the best match found, for best_candidate to choose from.
+        data = self.data
+        limit = min(len(data) - i, MAX_LONG_LENGTH)
+        if limit < minimum_span:
+            return []
+        best_len, best_pos = 0, -1
+        rel_len, rel_pos = 0, -1
+        for source in self.candidates(i):
+            if data[source:source+minimum_span] != data[i:i+minimum_span]:
+                continue
+            length = gallop(lambda n: data[source:source+n] == data[i:i+n], minimum_span, limit)
+            if length > best_len:
+                best_len, best_pos = length, source
+            if i - source <= MAX_RELATIVE_OFFSET and min(length, MAX_RELATIVE_LENGTH) > rel_len:
+                rel_len, rel_pos = min(length, MAX_RELATIVE_LENGTH), source
+        if best_len < self.fallback_below:
+            self.fallbacks += 1
+            length, source = self.longest(i, limit)
+            if length > best_len:
+                best_len, best_pos = length, source
+        if best_len < minimum_span:
+            return []
+        ret = []
+        if best_len > MAX_ABSOLUTE_LENGTH:
+            ret.append([[0xff, best_len & 0xff, best_len >> 8, best_pos & 0xff, best_pos >> 8], best_len])
+        length = min(best_len, MAX_ABSOLUTE_LENGTH)
+        ret.append([[0xc0 | length - 3, best_pos & 0xff, best_pos >> 8], length])
+        if best_pos >= 0 and i - best_pos <= MAX_RELATIVE_OFFSET and min(best_len, MAX_RELATIVE_LENGTH) >= rel_len:
+            rel_len, rel_pos = min(best_len, MAX_RELATIVE_LENGTH), best_pos
+        if rel_len >= minimum_span:
+            offset = i - rel_pos
+            ret.append([[((rel_len-3)<<4) | (offset >> 8), offset & 0xff], rel_len])
+        return ret
+
+def compress_copy(input_bytes, i, finder=None):
+    if finder is None:
+        finder = MatchFinder(input_bytes)
+    return finder.copies(i)
 
 def compress_raw(b):
     ret = [0x80 | len(b)]
     ret.extend(b)
     return ret
 
-def compress_optimal(input_bytes, minimum_span=MINIMUM_SPAN):
-    input_len = len(input_bytes)
-    
-    # DP table: min_cost[i] stores the minimum cost (length of compressed data) 
-    # to compress the input starting from index 'i'.
-    min_cost = [0] * (input_len + 1)
-    # best_command[i] stores the command bytes that achieve the min_cost[i]
-    best_command = [None] * (input_len + 1)
+PARSE_KINDS = ('fill', 'relative', 'absolute', 'long', 'raw')
+
+def shortest_path(finder, minimum_span=MINIMUM_SPAN, speed=0, cycle_table=None):
+    # Optimal parse. Walking backwards, min_cost[i] is the exact size of the best encoding
+    # of input[i:] (including the terminator) and best_command[i] is how it starts.
+    #
+    # Every command covers a range of lengths at a fixed size, so its best continuation is
+    # a minimum of min_cost over a window of end positions. The windows only ever slide
+    # towards the start of the input (a match at i is at most one byte shorter than the
+    # match at i - 1), so each command type keeps a monotonic deque and the whole parse
+    # is linear in the input size.
+    #
+    # With speed, the cost is the size plus speed bytes for every 1000 cycles the game takes
+    # to decompress it (see cycles.py). Costs that grow with the length of a command are
+    # folded into the deque key as min_cost[j] + slope * j, so the parse stays linear.
+    data = finder.data
+    input_len = len(data)
+    rel_len, rel_pos = finder.relative_matches()
+    match_len = finder.match_len
+    run_len = finder.run_len
+
+    weight = speed / 1000
+    if speed and cycle_table is None:
+        cycle_table = cycles.read_cycle_table()
+    def setup(kind):
+        return weight * cycle_table[kind][0] if speed else 0
+    def per_byte(kind):
+        return weight * cycle_table[kind][1] if speed else 0
+
+    # best_kind[i] indexes PARSE_KINDS and best_length[i] is the length of the command.
+    min_cost = array('d' if speed else 'i', bytes(8 if speed else 4)) * (input_len + 1)
+    min_cost[input_len] = 1 + setup('terminator')
+    best_kind = array('b', bytes(input_len + 1))
+    best_length = array('i', bytes(4 * (input_len + 1)))
+
+    # (kind, minimum length, fixed cost, cost per byte, maximum length per position or a constant)
+    # in the order of PARSE_KINDS. Raws cost one byte per byte as well as the header.
+    commands = [
+        ('fill', 1, 4 + setup('fill'), per_byte('fill'), run_len, MAX_FILL_LENGTH),
+        ('relative', minimum_span, 2 + setup('relative'), per_byte('relative'), rel_len, MAX_RELATIVE_LENGTH),
+        ('absolute', minimum_span, 3 + setup('absolute'), per_byte('absolute'), match_len, MAX_ABSOLUTE_LENGTH),
+        ('long', MAX_ABSOLUTE_LENGTH + 1, 5 + setup('long'), per_byte('long'), match_len, MAX_LONG_LENGTH),
+        ('raw', 1, 1 + setup('raw'), 1 + per_byte('raw'), None, MAX_RAW_LENGTH),
+    ]
+    windows = [deque() for _ in commands]
+
+    for i in range(input_len - 1, -1, -1):
+        best_cost = None
+        for kind, ((_, shortest, size, slope, lengths, longest), window) in enumerate(zip(commands, windows)):
+            j = i + shortest
+            if j <= input_len:
+                key = min_cost[j] + slope * j
+                while window and window[-1][0] >= key:
+                    window.pop()
+                window.append((key, j))
+            end = i + (longest if lengths is None else min(lengths[i], longest))
+            while window and window[0][1] > end:
+                window.popleft()
+            if not window:
+                continue
+            key, j = window[0]
+            cost = key - slope * i + size
+            if best_cost is None or cost < best_cost:
+                best_cost = cost
+                best_kind[i] = kind
+                best_length[i] = j - i
+        min_cost[i] = best_cost
+
+    return min_cost, best_kind, best_length
+
+def compress_shortest_path(finder, minimum_span=MINIMUM_SPAN, speed=0, cycle_table=None):
+    data = finder.data
+    input_len = len(data)
+    min_cost, best_kind, best_length = shortest_path(finder, minimum_span, speed, cycle_table)
+    rel_len, rel_pos = finder.relative_matches()
 
-    raw = []
     compressed_data = bytearray()
-    
-    current_idx = 0
-    while current_idx < len(input_bytes):
-        
-        # Initialize min cost for this position to infinity
-        best_cost_for_idx = float('inf')
-        best_cmd_for_idx = None
+    i = 0
+    while i < input_len:
+        kind, length = PARSE_KINDS[best_kind[i]], best_length[i]
+        if kind == 'raw':
+            compressed_data.extend(compress_raw(data[i:i+length]))
+        elif kind == 'fill':
+            compressed_data.extend([0xfe, length & 0xff, length >> 8, data[i]])
+        elif kind == 'relative':
+            offset = i - rel_pos[i]
+            compressed_data.extend([((length-3)<<4) | (offset >> 8), offset & 0xff])
+        elif kind == 'absolute':
+            index = finder.match_pos[i]
+            compressed_data.extend([0xc0 | length - 3, index & 0xff, index >> 8])
+        else:
+            index = finder.match_pos[i]
+            compressed_data.extend([0xff, length & 0xff, length >> 8, index & 0xff, index >> 8])
+        i += length
+    compressed_data.append(0x80)
+    return compressed_data
 
-        cmds = []
-        
-        # --- 1. Try Fill (0xff) ---
+def best_candidate(finder, i, minimum_span, prefer_relative):
+    cmds = []
+
+    # --- 1. Try Fill (0xfe) ---
+
+    cmds.extend(finder.fills(i))
 
-        cmds.extend(compress_fill(input_bytes, current_idx))
+    # --- 2. Try Copy(s) ---
 
-        # --- 2. Try Copy(s) ---
+    cmds.extend(finder.copies(i, minimum_span, prefer_relative))
 
-        cmds.extend(compress_copy(input_bytes, current_idx))
+    # --- 3. Calculate the winner ---
+    winner = [[], -1]
+    for cmd in cmds:
+        if (cmd[1] - len(cmd[0])) > (winner[1] - len(winner[0])):
+            winner = cmd
+    return winner
+
+def compress_greedy(finder, minimum_span=MINIMUM_SPAN, lazy=False, prefer_relative=False, stats=None):
+    # With lazy matching a command is put off by a byte whenever the next position has a
+    # better one, at the cost of one raw byte.
+    input_bytes = finder.data
+    raw = []
+    compressed_data = bytearray()
+    rejections = 0
+    deferrals = 0
 
-        # --- 3. Calculate the winner ---
-        winner = [[], -1]
-        for cmd in cmds:
-            if (cmd[1] - len(cmd[0])) > (winner[1] - len(winner[0])):
-                winner = cmd
+    current_idx = 0
+    winner = best_candidate(finder, current_idx, minimum_span, prefer_relative) if input_bytes else None
+    while current_idx < len(input_bytes):
 
         # Are we currently building a raw command? If so then there isn't a cost to adding to it.
         if len(raw) > 0:
@@ -104,26 +469,225 @@ def compress_optimal(input_bytes, minimum_span=MINIMUM_SPAN):
         else:
             threshold = 1
 
-        if (winner[1] - len(winner[0])) >= threshold:
+        gain = winner[1] - len(winner[0])
+        next_winner = None
+        if gain >= threshold and lazy and current_idx + 1 < len(input_bytes):
+            next_winner = best_candidate(finder, current_idx + 1, minimum_span, prefer_relative)
+            if next_winner[1] - len(next_winner[0]) > gain:
+                gain = -1
+                deferrals += 1
+
+        if gain >= threshold:
             if len(raw):
                 compressed_data.extend(compress_raw(raw))
                 raw = []
             compressed_data.extend(winner[0])
             current_idx += winner[1]
+            next_winner = None
         else:
+            if gain >= 0:
+                # There was a match, but it doesn't save enough to be worth ending the raw run.
+                rejections += 1
             raw.append(input_bytes[current_idx])
             current_idx += 1
             if len(raw) == MAX_RAW_LENGTH:
                 compressed_data.extend(compress_raw(raw))
                 raw = []
 
+        if current_idx < len(input_bytes):
+            winner = next_winner or best_candidate(finder, current_idx, minimum_span, prefer_relative)
+
     if len(raw):
         compressed_data.extend(compress_raw(raw))
     compressed_data.append(0x80)
-            
+
+    if stats is not None:
+        stats['threshold_rejections'] = rejections
+        stats['lazy_deferrals'] = deferrals
+    return compressed_data
+
+def check_input_size(input_bytes):
+    if len(input_bytes) > MAX_INPUT_SIZE:
+        raise ValueError(f"{len(input_bytes)} bytes is too much to compress as one block: copies can only "
+                         f"address the first 0x{MAX_INPUT_SIZE:x} ({MAX_INPUT_SIZE}) bytes. Split the data into blocks.")
+
+def estimate_size(input_bytes, minimum_span=MINIMUM_SPAN):
+    # Exact size of the optimal parse, without building the output.
+    check_input_size(input_bytes)
+    return shortest_path(MatchFinder(input_bytes), minimum_span)[0][0]
+
+def quick_estimate_size(input_bytes, minimum_span=MINIMUM_SPAN):
+    # Size of the fast tilemap parse: a few bytes over the optimal size, in a fraction of the time.
+    return len(compress_optimal(input_bytes, minimum_span, tilemap=True))
+
+def fastest_within(finder, minimum_span, speed, limit, cycle_table=None):
+    # A higher speed weight gives up size for fewer cycles. Search for the highest weight, up
+    # to speed, whose output still fits in limit bytes.
+    if cycle_table is None:
+        cycle_table = cycles.read_cycle_table()
+    compressed_data = compress_shortest_path(finder, minimum_span, speed, cycle_table)
+    if len(compressed_data) <= limit:
+        return compressed_data
+    best = compress_shortest_path(finder, minimum_span)
+    low, high = 0, speed
+    for _ in range(12):
+        middle = (low + high) / 2
+        compressed_data = compress_shortest_path(finder, minimum_span, middle, cycle_table)
+        if len(compressed_data) <= limit:
+            best, low = compressed_data, middle
+        else:
+            high = middle
+    return best
+
+def compress_optimal(input_bytes, minimum_span=MINIMUM_SPAN, optimal=False, lazy=False, prefer_relative=False,
+                     stats=None, speed=0, limit=None, tilemap=False):
+    """
+    Compresses input_bytes. Pass a dict as stats to have it filled in with the time spent finding
+    matches and parsing, how often the raw-run threshold turned a match down (greedy parses) and
+    the count and size of each command type in the output. Without it nothing is measured.
+    speed (with optimal) trades size for decompression time: each 1000 estimated cycles costs as
+    much as speed bytes. With limit as well, the weight is lowered as needed to fit in limit bytes.
+    tilemap is a fast greedy parse for tilemaps (see TilemapMatcher), usually within a few bytes
+    of the optimal parse; optimal and speed don't apply to it.
+    Raises ValueError for inputs over MAX_INPUT_SIZE bytes.
+    """
+    check_input_size(input_bytes)
+    if tilemap:
+        start = time.perf_counter()
+        finder = TilemapMatcher(input_bytes)
+        compressed_data = compress_greedy(finder, minimum_span, lazy, prefer_relative, stats)
+        if stats is not None:
+            stats['match_seconds'] = 0
+            stats['parse_seconds'] = time.perf_counter() - start
+            stats['fallback_searches'] = finder.fallbacks
+            stats.update(decompress.command_stats(compressed_data))
+            stats['estimated_cycles'] = cycles.estimate_cycles(compressed_data)
+        return compressed_data
+
+    if stats is None:
+        finder = MatchFinder(input_bytes)
+        if optimal and speed and limit is not None:
+            return fastest_within(finder, minimum_span, speed, limit)
+        if optimal:
+            return compress_shortest_path(finder, minimum_span, speed)
+        return compress_greedy(finder, minimum_span, lazy, prefer_relative)
+
+    start = time.perf_counter()
+    finder = MatchFinder(input_bytes)
+    if optimal or prefer_relative:
+        finder.relative_matches()
+    matched = time.perf_counter()
+    if optimal and speed and limit is not None:
+        compressed_data = fastest_within(finder, minimum_span, speed, limit)
+    elif optimal:
+        compressed_data = compress_shortest_path(finder, minimum_span, speed)
+    else:
+        compressed_data = compress_greedy(finder, minimum_span, lazy, prefer_relative, stats)
+    stats['match_seconds'] = matched - start
+    stats['parse_seconds'] = time.perf_counter() - matched
+    stats.update(decompress.command_stats(compressed_data))
+    stats['estimated_cycles'] = cycles.estimate_cycles(compressed_data)
     return compressed_data
 
-def run_compressor(filename, minimum_span):
+def portfolio_strategies():
+    # Every parse shares one cost model and the optimal parse is the smallest under it, so a greedy
+    # parse can never beat it. The greedy parses are only a fallback (fallback_strategies).
+    return [{'optimal': True, 'minimum_span': MINIMUM_SPAN}]
+
+def fallback_strategies():
+    strategies = []
+    for lazy in (False, True):
+        for prefer_relative in (False, True):
+            for span in range(3, 11):
+                strategies.append({'minimum_span': span, 'lazy': lazy, 'prefer_relative': prefer_relative})
+    return strategies
+
+def run_strategies(input_bytes, strategies):
+    # One match finder serves every strategy in the group. Each result is checked by
+    # decompressing it again; the ones that don't round trip are dropped.
+    finder = MatchFinder(input_bytes)
+    results = []
+    for strategy in strategies:
+        if strategy.get('optimal'):
+            compressed_data = compress_shortest_path(finder, strategy['minimum_span'])
+        else:
+            compressed_data = compress_greedy(finder, **strategy)
+        try:
+            ok = decompress.decompress(compressed_data)[0] == finder.data
+        except ValueError:
+            ok = False
+        results.append((bytes(compressed_data), strategy, ok))
+    return results
+
+def compress_portfolio(input_bytes, jobs=None, strategies=None):
+    """
+    Compresses with several strategies in parallel and keeps the smallest output that
+    decompresses back to the input. Returns (compressed data, winning strategy).
+    By default that is the optimal parse, and the greedy fallback_strategies only run if its
+    output doesn't round trip.
+    """
+    check_input_size(input_bytes)
+    rounds = [strategies] if strategies else [portfolio_strategies(), fallback_strategies()]
+    for candidates in rounds:
+        workers = min(jobs or os.cpu_count() or 1, len(candidates))
+        groups = [candidates[n::workers] for n in range(workers)]
+        if workers == 1:
+            results = run_strategies(input_bytes, candidates)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = [r for group in pool.map(run_strategies, [input_bytes] * workers, groups) for r in group]
+        valid = [(len(c), n, c, strategy) for n, (c, strategy, ok) in enumerate(results) if ok]
+        if valid:
+            _, _, compressed_data, strategy = min(valid)
+            return bytearray(compressed_data), strategy
+    raise ValueError("No strategy produced output that decompresses correctly.")
+
+def describe_strategy(strategy):
+    if strategy.get('tilemap'):
+        parse = "lazy" if strategy.get('lazy') else "greedy"
+        return f"fast tilemap {parse} parse, min_span={strategy['minimum_span']}"
+    if strategy.get('optimal'):
+        if strategy.get('speed'):
+            within = f" within {strategy['limit']} bytes" if strategy.get('limit') is not None else ""
+            return f"optimal parse, speed weight {strategy['speed']}{within}"
+        return "optimal parse"
+    parse = "lazy" if strategy.get('lazy') else "greedy"
+    relative = ", prefer relative" if strategy.get('prefer_relative') else ""
+    return f"{parse}, min_span={strategy['minimum_span']}{relative}"
+
+def compress_cached(input_bytes, strategy, output_cache, jobs=None, stats=None):
+    """
+    Compresses with the given strategy (or every strategy when strategy is None), reusing
+    a previous result from output_cache when the input, settings and compressor version match.
+    Returns (compressed data, winning strategy or None for a cached portfolio result).
+    stats is filled in as for compress_optimal; cached and portfolio results only get the
+    command counts, with 'cached' set for the former.
+    """
+    settings = sorted((strategy or {'portfolio': True}).items())
+    if strategy and strategy.get('speed'):
+        settings.append(sorted(cycles.read_cycle_table().items()))
+    key = cache.make_key(bytes(input_bytes), COMPRESSOR_VERSION, settings)
+    compressed_data = output_cache.get(key) if output_cache is not None else None
+    if compressed_data is not None:
+        if stats is not None:
+            stats['cached'] = True
+            stats.update(decompress.command_stats(compressed_data))
+            stats['estimated_cycles'] = cycles.estimate_cycles(compressed_data)
+        return bytearray(compressed_data), strategy
+    if strategy is None:
+        compressed_data, strategy = compress_portfolio(input_bytes, jobs)
+        if stats is not None:
+            stats.update(decompress.command_stats(compressed_data))
+            stats['estimated_cycles'] = cycles.estimate_cycles(compressed_data)
+    else:
+        compressed_data = compress_optimal(input_bytes, **strategy, stats=stats)
+    if output_cache is not None:
+        output_cache.put(key, bytes(compressed_data))
+    return compressed_data, strategy
+
+def run_compressor(filename, minimum_span, optimal=False, lazy=False, prefer_relative=False,
+                   portfolio=False, jobs=None, limit=None, output_cache=None, show_stats=False, speed=0,
+                   tilemap=False):
     try:
         with open(filename, 'rb') as f:
             input_bytes = f.read()
@@ -131,8 +695,31 @@ def run_compressor(filename, minimum_span):
         print(f"Error reading file: {e}")
         sys.exit(1)
     
-    print(f"Read {len(input_bytes)} bytes from {filename}. Compressing with min_span={minimum_span}...")
-    compressed_data = compress_optimal(input_bytes, minimum_span)
+    hits = output_cache.hits if output_cache is not None else 0
+    stats = {} if show_stats else None
+    if portfolio:
+        print(f"Read {len(input_bytes)} bytes from {filename}. Compressing with every strategy...")
+        try:
+            compressed_data, strategy = compress_cached(input_bytes, None, output_cache, jobs, stats)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        if strategy is not None:
+            print(f"Smallest output from {describe_strategy(strategy)}.")
+    else:
+        strategy = {'minimum_span': minimum_span, 'optimal': optimal, 'lazy': lazy, 'prefer_relative': prefer_relative}
+        if speed:
+            strategy.update(optimal=True, speed=speed, limit=limit)
+        if tilemap:
+            strategy['tilemap'] = True
+        print(f"Read {len(input_bytes)} bytes from {filename}. Compressing with {describe_strategy(strategy)}...")
+        try:
+            compressed_data, _ = compress_cached(input_bytes, strategy, output_cache, stats=stats)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    if output_cache is not None and output_cache.hits > hits:
+        print("Using the cached result.")
 
     output_filename = filename
     if output_filename.lower().endswith('.bin'):
@@ -146,25 +733,76 @@ def run_compressor(filename, minimum_span):
     print(f"\nCompression complete.")
     print(f"Original size: {len(input_bytes)} bytes")
     print(f"Compressed size: {len(compressed_data)} bytes")
+    if speed:
+        print(f"Estimated decompression time: {cycles.estimate_cycles(compressed_data):.0f} cycles")
+    if limit is not None:
+        if len(compressed_data) > limit:
+            print(f"Over the limit of 0x{limit:x} ({limit}) bytes by {len(compressed_data) - limit}!")
+        else:
+            print(f"Fits the limit of 0x{limit:x} ({limit}) bytes with {limit - len(compressed_data)} to spare.")
     print(f"Wrote output to {output_filename}")
+    if stats is not None:
+        print(json.dumps(stats, indent=2))
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python script_name.py <filename> [minimum_span]")
-        print("Example: python script_name.py level1.bin 4")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Compress raw files.",
+                                     epilog="Example: python compress.py level1.bin 4")
+    parser.add_argument('filenames', nargs='*', metavar='filename')
+    parser.add_argument('--span', type=int, default=None, dest='minimum_span',
+                        help=f"minimum_span, 3-10 (default {MINIMUM_SPAN}; can also follow a single filename)")
+    parser.add_argument('--optimal', action='store_true',
+                        help="find the smallest possible encoding instead of parsing greedily")
+    parser.add_argument('--lazy', action='store_true',
+                        help="put a copy off by a byte when the next position has a better one")
+    parser.add_argument('--prefer-relative', action='store_true',
+                        help="use a relative copy whenever one is as long as the absolute copy")
+    parser.add_argument('--portfolio', action='store_true',
+                        help="try every strategy in parallel and keep the smallest result")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes for --portfolio")
+    parser.add_argument('--limit', type=lambda x: int(x, 0), default=None,
+                        help="report whether the output fits in this many bytes (e.g. 0x1c0)")
+    parser.add_argument('--speed', type=float, default=0,
+                        help="trade size for faster decompression: each 1000 estimated cycles (see cycles.txt) "
+                             "counts as this many bytes. With --limit, the weight is lowered as needed to fit.")
+    parser.add_argument('--tilemap', action='store_true',
+                        help="fast mode for tilemaps: tries word-aligned and row-stride matches first, "
+                             "usually within a few bytes of --optimal")
+    parser.add_argument('--stats', action='store_true',
+                        help="print per-command statistics and timings as JSON")
+    parser.add_argument('--no-cache', action='store_true', help="always compress, and don't store the result")
+    parser.add_argument('--cache-info', action='store_true', help="show what is in the cache and exit")
+    parser.add_argument('--cache-clear', action='store_true', help="empty the cache and exit")
+    args = parser.parse_args()
 
-    input_filename = sys.argv[1]
-    span = MINIMUM_SPAN
-    if len(sys.argv) == 3:
-        try:
-            span = int(sys.argv[2])
-            if span < 3 or span > 10:
-                raise ValueError("Minimum span must be between 3 and 10.")
-        except ValueError as e:
-            print(f"Invalid span argument: {e}")
-            sys.exit(1)
+    output_cache = None if args.no_cache else cache.DiskCache('compressed')
+    if args.cache_info or args.cache_clear:
+        output_cache = output_cache or cache.DiskCache('compressed')
+        if args.cache_clear:
+            print(f"Removed {output_cache.clear()} cached results.")
+        print(output_cache.info())
+        sys.exit(0)
 
-    run_compressor(input_filename, span)
+    # The original usage was "compress.py <filename> [minimum_span]".
+    if args.minimum_span is None and len(args.filenames) == 2 and args.filenames[1].isdigit():
+        args.minimum_span = int(args.filenames.pop())
+    if args.minimum_span is None:
+        args.minimum_span = MINIMUM_SPAN
+    if not args.filenames:
+        parser.error("No input files given.")
+    if args.speed and args.portfolio:
+        parser.error("--speed can't be combined with --portfolio.")
+    if args.tilemap and (args.optimal or args.speed or args.portfolio):
+        parser.error("--tilemap can't be combined with --optimal, --speed or --portfolio.")
+    if args.speed < 0:
+        parser.error("--speed can't be negative.")
+    if args.minimum_span < 3 or args.minimum_span > 10:
+        parser.error("Minimum span must be between 3 and 10.")
 
+    for input_filename in args.filenames:
+        run_compressor(input_filename, args.minimum_span, args.optimal, args.lazy, args.prefer_relative,
+                       args.portfolio, args.jobs, args.limit, output_cache, args.stats, args.speed,
+                       args.tilemap)
+    if output_cache is not None and len(args.filenames) > 1:
+        print()
+        print(output_cache.hit_rate())
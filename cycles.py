@@ -0,0 +1,45 @@
+import os
+
+import decompress
+
+# Estimates how long the game takes to decompress a block from the commands in it, using the
+# per-command costs in cycles.txt.
+
+DEFAULT_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cycles.txt')
+KINDS = ('terminator',) + decompress.COMMAND_KINDS
+
+def read_cycle_table(filename=DEFAULT_TABLE):
+    """Returns {kind: (setup cycles, cycles per byte)}. Raises ValueError for a bad table."""
+    table = {}
+    with open(filename, 'r') as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) != 3 or fields[0] not in KINDS:
+                raise ValueError(f"{filename}:{number}: expected a command kind, setup and per-byte cycles")
+            try:
+                table[fields[0]] = (float(fields[1]), float(fields[2]))
+            except ValueError:
+                raise ValueError(f"{filename}:{number}: cycles must be numbers")
+    missing = [kind for kind in KINDS if kind not in table]
+    if missing:
+        raise ValueError(f"{filename}: no cycles given for {', '.join(missing)}")
+    return table
+
+def command_cycles(table, kind, length):
+    setup, per_byte = table[kind]
+    return setup + per_byte * length
+
+def estimate_cycles(buffer, offset=0, table=None):
+    """Estimated cycles to decompress the block at offset."""
+    if table is None:
+        table = read_cycle_table()
+    parser = decompress.iter_commands(buffer, offset)
+    cycles = command_cycles(table, 'terminator', 0)
+    while True:
+        try:
+            kind, _, _, length, _ = next(parser)
+        except StopIteration:
+            return cycles
+        cycles += command_cycles(table, kind, length)
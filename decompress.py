@@ -1,158 +1,363 @@
 import sys
+import json
+import mmap
 import struct
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
 
-def decompress_data_from_file(filename, start_offset):
-    try:
-        with open(filename, 'rb') as f:
-            f.seek(start_offset)
-            compressed_data = bytearray(f.read())
-    except IOError as e:
-        print(f"Error reading file: {e}")
-        return None
+def copy_from_output(decompressed_buffer, source, length):
+    # Copies may overlap the bytes they produce (the game copies one byte at a time), in which
+    # case the output simply repeats the part of the source that already exists.
+    available = len(decompressed_buffer) - source
+    if length <= available:
+        decompressed_buffer += decompressed_buffer[source:source+length]
+    else:
+        pattern = decompressed_buffer[source:]
+        decompressed_buffer += (pattern * (length // available + 1))[:length]
 
-    decompressed_buffer = bytearray()
-    comp_idx = 0
-    comp_len = len(compressed_data)
-    original_offset = start_offset
+@contextmanager
+def open_rom(filename):
+    """
+    Memory-maps a ROM (or any file) read-only and yields a memoryview of it.
+    Blocks can then be decoded straight from the view without copying the file.
+    Don't keep slices of the view past the end of the with block.
+    """
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as rom:
+            with memoryview(rom) as view:
+                yield view
+
+def decompress_into(decompressed_buffer, buffer, offset=0):
+    """
+    Generator that decodes one command at a time from buffer into decompressed_buffer,
+    yielding after each command. Returns the number of compressed bytes consumed.
+    """
+    comp_idx = offset
+    comp_len = len(buffer)
 
     while comp_idx < comp_len:
-        control_byte = compressed_data[comp_idx]
+        control_byte = buffer[comp_idx]
 
         if control_byte == 0x80:
             # 1. Terminator Block
-#            print(f"[0x{original_offset + comp_idx:x}] TERMINATOR (0x80) found. Stopping.")
             comp_idx += 1
-            break
+            return comp_idx - offset
         elif control_byte == 0xfe:
             # 2. Fill command
-            comp_idx += 1
-            # Read 2 bytes for LSB-first (Little Endian) offset
-            if comp_idx + 1 >= comp_len:
-                print(f"Error: Unexpected end of data for 4-byte command at 0x{original_offset + comp_idx - 1:x}.")
-                break
-
-            # Use struct for reliable LE word reading
-            length = struct.unpack('<H', compressed_data[comp_idx:comp_idx+2])[0]
-            comp_idx += 2
-            if comp_idx < comp_len:
-                fill_byte = compressed_data[comp_idx]
-            else:
-                print(f"Error: Reached end of compressed data during raw copy at offset 0x{original_offset + comp_idx:x}.")
-                break
-            comp_idx += 1
-#            print(f"[0x{original_offset + comp_idx - 4:x}] FILL (0x7e) found. Value: 0x{fill_byte:x}, Len: 0x{length:x}")
-            for _ in range(length):
-                decompressed_buffer.append(fill_byte)
+            if comp_idx + 3 >= comp_len:
+                raise ValueError(f"Unexpected end of data for 4-byte command at 0x{comp_idx:x}.")
+            # 2 bytes for LSB-first (Little Endian) length, then the fill byte
+            length, fill_byte = struct.unpack_from('<HB', buffer, comp_idx + 1)
+            comp_idx += 4
+            decompressed_buffer += bytes((fill_byte,)) * length
         elif control_byte == 0xff:
             # 2. Long copy
+            if comp_idx + 4 >= comp_len:
+                raise ValueError(f"Unexpected end of data for 5-byte command at 0x{comp_idx:x}.")
+            # LSB-first (Little Endian) length and absolute offset
+            length, offset_absolute = struct.unpack_from('<HH', buffer, comp_idx + 1)
+            comp_idx += 5
+            if offset_absolute >= len(decompressed_buffer):
+                raise ValueError(f"Absolute offset {offset_absolute} out of bounds at 0x{comp_idx - 5:x}.")
+            copy_from_output(decompressed_buffer, offset_absolute, length)
+        elif (control_byte & 0xc0) == 0xc0:
+            # Sub-mode B: Absolute Buffer Copy (Bit 6 is set: 0xEC, 0xFE, etc.)
+            length = (control_byte & 0x3F) + 3
+            if comp_idx + 2 >= comp_len:
+                raise ValueError(f"Unexpected end of data for 3-byte command at 0x{comp_idx:x}.")
+            # LSB-first (Little Endian) offset
+            offset_absolute, = struct.unpack_from('<H', buffer, comp_idx + 1)
+            comp_idx += 3
+            if offset_absolute >= len(decompressed_buffer):
+                raise ValueError(f"Absolute offset {offset_absolute} out of bounds at 0x{comp_idx - 3:x}.")
+            copy_from_output(decompressed_buffer, offset_absolute, length)
+        elif (control_byte & 0x80):
+            # 2. Raw Bytes Block (High bit set)
+            length = control_byte & 0x3F
             comp_idx += 1
-
-            # Read 2 bytes for LSB-first (Little Endian) offset
+            if comp_idx + length > comp_len:
+                raise ValueError(f"Reached end of compressed data during raw copy at offset 0x{comp_len:x}.")
+            decompressed_buffer += buffer[comp_idx:comp_idx+length]
+            comp_idx += length
+        else:
+            # 3. Copy from Previous Bytes Block (High bit clear)
             if comp_idx + 1 >= comp_len:
-                print(f"Error: Unexpected end of data for 5-byte command at 0x{original_offset + comp_idx - 1:x}.")
-                break
-            # Use struct for reliable LE word reading
-            length = struct.unpack('<H', compressed_data[comp_idx:comp_idx+2])[0]
+                raise ValueError(f"Unexpected end of data for 2-byte command at 0x{comp_idx:x}.")
+            word = (control_byte << 8) | buffer[comp_idx + 1]
             comp_idx += 2
+            length = ((word & 0x7000) >> 12) + 3
+            offset_relative = word & 0x0FFF
+            start_pos = len(decompressed_buffer) - offset_relative
+            if offset_relative == 0 or start_pos < 0:
+                raise ValueError(f"Relative offset {offset_relative} resulted in out of bounds read at 0x{comp_idx - 2:x}.")
+            copy_from_output(decompressed_buffer, start_pos, length)
+        yield
+
+    raise ValueError(f"Reached end of compressed data at offset 0x{comp_len:x} without a terminator.")
 
-            # Read 2 bytes for LSB-first (Little Endian) offset
+def decompress(buffer, offset=0):
+    """
+    Decompresses the block starting at offset within buffer (bytes, bytearray, mmap or memoryview).
+    Returns the decompressed bytearray and the number of compressed bytes consumed,
+    including the terminator. Raises ValueError if the block is malformed.
+    """
+    decompressed_buffer = bytearray()
+    commands = decompress_into(decompressed_buffer, buffer, offset)
+    while True:
+        try:
+            next(commands)
+        except StopIteration as stop:
+            return decompressed_buffer, stop.value
+
+def iter_decompress(buffer, offset=0):
+    """
+    Yields the decompressed data in chunks as each command is parsed, so callers can stop
+    as soon as they have the rows or tiles they need. Returns the number of compressed bytes
+    consumed once the terminator is reached.
+    """
+    decompressed_buffer = bytearray()
+    commands = decompress_into(decompressed_buffer, buffer, offset)
+    start = 0
+    while True:
+        try:
+            next(commands)
+        except StopIteration as stop:
+            return stop.value
+        if len(decompressed_buffer) > start:
+            yield bytes(decompressed_buffer[start:])
+            start = len(decompressed_buffer)
+
+def measure(buffer, offset=0, max_output=0x10000):
+    """
+    Checks whether a valid compressed block starts at offset without decompressing it.
+    Returns (decompressed size, compressed bytes consumed) or None as soon as the data can't be
+    a block: a copy from beyond the output so far, output larger than max_output, running off
+    the end of the buffer, or a zero length fill or long copy (valid, but never written).
+    """
+    comp_idx = offset
+    comp_len = len(buffer)
+    size = 0
+    while comp_idx < comp_len:
+        control_byte = buffer[comp_idx]
+        if control_byte == 0x80:
+            return size, comp_idx + 1 - offset
+        elif control_byte == 0xfe:
+            if comp_idx + 3 >= comp_len:
+                return None
+            length = buffer[comp_idx + 1] | (buffer[comp_idx + 2] << 8)
+            if length == 0:
+                return None
+            comp_idx += 4
+        elif control_byte == 0xff:
+            if comp_idx + 4 >= comp_len:
+                return None
+            length = buffer[comp_idx + 1] | (buffer[comp_idx + 2] << 8)
+            if length == 0 or (buffer[comp_idx + 3] | (buffer[comp_idx + 4] << 8)) >= size:
+                return None
+            comp_idx += 5
+        elif control_byte >= 0xc0:
+            if comp_idx + 2 >= comp_len or (buffer[comp_idx + 1] | (buffer[comp_idx + 2] << 8)) >= size:
+                return None
+            length = (control_byte & 0x3F) + 3
+            comp_idx += 3
+        elif control_byte & 0x80:
+            length = control_byte & 0x3F
+            comp_idx += 1 + length
+        else:
             if comp_idx + 1 >= comp_len:
-                print(f"Error: Unexpected end of data for 5-byte command at 0x{original_offset + comp_idx - 1:x}.")
-                break
-            # Use struct for reliable LE word reading
-            offset_absolute = struct.unpack('<H', compressed_data[comp_idx:comp_idx+2])[0]
+                return None
+            offset_relative = ((control_byte & 0x0f) << 8) | buffer[comp_idx + 1]
+            if offset_relative == 0 or offset_relative > size:
+                return None
+            length = (control_byte >> 4) + 3
             comp_idx += 2
+        size += length
+        if size > max_output:
+            return None
+    return None
 
-#            print(f"[0x{original_offset + comp_idx - 3:x}] LONG copy. Len: 0x{length:x}, Offset: {offset_absolute}")
-
-            for _ in range(length):
-                if offset_absolute < len(decompressed_buffer):
-                    byte_to_copy = decompressed_buffer[offset_absolute]
-                    decompressed_buffer.append(byte_to_copy)
-                    offset_absolute += 1
-                else:
-                    print(f"Error: Absolute offset {offset_absolute} out of bounds at source index {offset_absolute}.")
-                    break
-        elif (control_byte & 0xc0) == 0xc0: 
-            # Sub-mode B: Absolute Buffer Copy (Bit 6 is set: 0xEC, 0xFE, etc.)
-            byte1 = control_byte
-            length = (byte1 & 0x3F) + 3
-            comp_idx += 1
-                
-            # Read 2 bytes for LSB-first (Little Endian) offset
-            if comp_idx + 1 >= comp_len:
-                print(f"Error: Unexpected end of data for 3-byte command at 0x{original_offset + comp_idx - 1:x}.")
-                break
+COMMAND_KINDS = ('raw', 'fill', 'relative', 'absolute', 'long')
+COMMAND_SIZES = {'fill': 4, 'relative': 2, 'absolute': 3, 'long': 5} # raw is 1 + its length
 
-            # Use struct for reliable LE word reading
-            offset_absolute = struct.unpack('<H', compressed_data[comp_idx:comp_idx+2])[0]
-            comp_idx += 2
-             
-#            print(f"[0x{original_offset + comp_idx - 3:x}] ABSOLUTE copy. Len: 0x{length:x}, Offset: {offset_absolute}")
-
-            for _ in range(length):
-                if offset_absolute < len(decompressed_buffer):
-                    byte_to_copy = decompressed_buffer[offset_absolute]
-                    decompressed_buffer.append(byte_to_copy)
-                    offset_absolute += 1
-                else:
-                    print(f"Error: Absolute offset {offset_absolute} out of bounds at source index {offset_absolute}.")
-                    break
+def iter_commands(buffer, offset=0):
+    """
+    Parses the block at offset without decompressing it, yielding (kind, compressed position,
+    output position, length, argument) for each command. The argument is the fill byte for fills,
+    the absolute source position for copies and None for raws.
+    Returns the number of compressed bytes consumed. Raises ValueError if the block is malformed.
+    """
+    comp_idx = offset
+    comp_len = len(buffer)
+    out_pos = 0
+    while comp_idx < comp_len:
+        control_byte = buffer[comp_idx]
+        if control_byte == 0x80:
+            return comp_idx + 1 - offset
+        elif control_byte == 0xfe:
+            if comp_idx + 3 >= comp_len:
+                raise ValueError(f"Unexpected end of data for 4-byte command at 0x{comp_idx:x}.")
+            length, fill_byte = struct.unpack_from('<HB', buffer, comp_idx + 1)
+            yield 'fill', comp_idx, out_pos, length, fill_byte
+            comp_idx += 4
+        elif control_byte == 0xff:
+            if comp_idx + 4 >= comp_len:
+                raise ValueError(f"Unexpected end of data for 5-byte command at 0x{comp_idx:x}.")
+            length, offset_absolute = struct.unpack_from('<HH', buffer, comp_idx + 1)
+            if offset_absolute >= out_pos:
+                raise ValueError(f"Absolute offset {offset_absolute} out of bounds at 0x{comp_idx:x}.")
+            yield 'long', comp_idx, out_pos, length, offset_absolute
+            comp_idx += 5
+        elif (control_byte & 0xc0) == 0xc0:
+            if comp_idx + 2 >= comp_len:
+                raise ValueError(f"Unexpected end of data for 3-byte command at 0x{comp_idx:x}.")
+            length = (control_byte & 0x3F) + 3
+            offset_absolute, = struct.unpack_from('<H', buffer, comp_idx + 1)
+            if offset_absolute >= out_pos:
+                raise ValueError(f"Absolute offset {offset_absolute} out of bounds at 0x{comp_idx:x}.")
+            yield 'absolute', comp_idx, out_pos, length, offset_absolute
+            comp_idx += 3
         elif (control_byte & 0x80):
-            # 2. Raw Bytes Block (High bit set)
-            comp_idx += 1
             length = control_byte & 0x3F
-#            print(f"[0x{original_offset + comp_idx - 1:x}] RAW bytes block. Length: 0x{length:x}")
-            for _ in range(length):
-                if comp_idx < comp_len:
-                    decompressed_buffer.append(compressed_data[comp_idx])
-                    comp_idx += 1
-                else:
-                    print(f"Error: Reached end of compressed data during raw copy at offset 0x{original_offset + comp_idx:x}.")
-                    break
+            if comp_idx + 1 + length > comp_len:
+                raise ValueError(f"Reached end of compressed data during raw copy at offset 0x{comp_len:x}.")
+            yield 'raw', comp_idx, out_pos, length, None
+            comp_idx += 1 + length
         else:
-            # 3. Copy from Previous Bytes Block (High bit clear)
-            byte1 = control_byte
-                
             if comp_idx + 1 >= comp_len:
-                print(f"Error: Unexpected end of data for 2-byte command at 0x{original_offset + comp_idx:x}.")
-                break
-                    
-            byte2 = compressed_data[comp_idx + 1]
-            comp_idx += 2
-                
-            word = (byte1 << 8) | byte2
+                raise ValueError(f"Unexpected end of data for 2-byte command at 0x{comp_idx:x}.")
+            word = (control_byte << 8) | buffer[comp_idx + 1]
             length = ((word & 0x7000) >> 12) + 3
             offset_relative = word & 0x0FFF
-                
-#            print(f"[0x{original_offset + comp_idx - 2:x}] RELATIVE copy. Len: 0x{length:x}, Rel Offset: {offset_relative}")
+            if offset_relative == 0 or offset_relative > out_pos:
+                raise ValueError(f"Relative offset {offset_relative} resulted in out of bounds read at 0x{comp_idx:x}.")
+            yield 'relative', comp_idx, out_pos, length, out_pos - offset_relative
+            comp_idx += 2
+        out_pos += length
+    raise ValueError(f"Reached end of compressed data at offset 0x{comp_len:x} without a terminator.")
+
+def command_stats(buffer, offset=0):
+    """
+    Counts the commands in a compressed block: for each kind, how many there are, how many
+    output bytes they produce and how many compressed bytes they take.
+    """
+    commands = {kind: {'count': 0, 'bytes': 0, 'size': 0} for kind in COMMAND_KINDS}
+    parser = iter_commands(buffer, offset)
+    decompressed_size = 0
+    while True:
+        try:
+            kind, _, _, length, _ = next(parser)
+        except StopIteration as stop:
+            compressed_size = stop.value
+            break
+        entry = commands[kind]
+        entry['count'] += 1
+        entry['bytes'] += length
+        entry['size'] += 1 + length if kind == 'raw' else COMMAND_SIZES[kind]
+        decompressed_size += length
+    copies = [commands[kind] for kind in ('relative', 'absolute', 'long')]
+    copy_count = sum(c['count'] for c in copies)
+    return {
+        'compressed_size': compressed_size,
+        'decompressed_size': decompressed_size,
+        'commands': commands,
+        'average_match_length': sum(c['bytes'] for c in copies) / copy_count if copy_count else 0,
+    }
+
+class BlockIndex:
+    """
+    The commands of a compressed block with their compressed and output positions, so that any
+    range of the output can be decoded without decoding everything before it. Only the commands
+    that produce the range, or that it copies from (directly or through other copies), are decoded.
+    """
+    def __init__(self, buffer, offset=0):
+        self.buffer = buffer
+        self.commands = []
+        parser = iter_commands(buffer, offset)
+        while True:
+            try:
+                self.commands.append(next(parser))
+            except StopIteration as stop:
+                self.consumed = stop.value
+                break
+        self.starts = [command[2] for command in self.commands]
+        self.size = self.starts[-1] + self.commands[-1][3] if self.commands else 0
+
+    def command_at(self, position):
+        """The index of the command that produces output byte position."""
+        return bisect_right(self.starts, position) - 1
+
+    def needed(self, start, end):
+        """The indexes of the commands that must be decoded to produce output[start:end], in order."""
+        needed = set()
+        pending = [(start, end)]
+        while pending:
+            start, end = pending.pop()
+            if start >= end:
+                continue
+            index = self.command_at(start)
+            while index < len(self.commands) and self.starts[index] < end:
+                if index not in needed and self.commands[index][3]:
+                    needed.add(index)
+                    kind, _, out_pos, length, source = self.commands[index]
+                    if kind not in ('raw', 'fill'):
+                        # A copy that overlaps itself only reads what was there before it started.
+                        pending.append((source, min(source + length, out_pos)))
+                index += 1
+        return sorted(needed)
+
+    def decompress_range(self, start, end):
+        """Returns output[start:end], clipped to the size of the block."""
+        end = min(end, self.size)
+        if start >= end:
+            return b''
+        output = bytearray(self.size)
+        buffer = self.buffer
+        for index in self.needed(start, end):
+            kind, comp_pos, out_pos, length, arg = self.commands[index]
+            if kind == 'raw':
+                output[out_pos:out_pos + length] = buffer[comp_pos + 1:comp_pos + 1 + length]
+            elif kind == 'fill':
+                output[out_pos:out_pos + length] = bytes((arg,)) * length
+            elif arg + length <= out_pos:
+                output[out_pos:out_pos + length] = output[arg:arg + length]
+            else:
+                pattern = output[arg:out_pos]
+                output[out_pos:out_pos + length] = (pattern * (length // len(pattern) + 1))[:length]
+        return bytes(output[start:end])
+
+def decompress_range(buffer, start, end, offset=0):
+    """Decodes just output[start:end] of the block at offset. See BlockIndex."""
+    return BlockIndex(buffer, offset).decompress_range(start, end)
+
+def decompress_data_from_file(filename, start_offset):
+    try:
+        with open_rom(filename) as rom:
+            decompressed_buffer, comp_idx = decompress(rom, start_offset)
+    except (IOError, ValueError) as e:
+        print(f"Error: {e}")
+        return None
 
-            start_pos = len(decompressed_buffer) - offset_relative
-            for i in range(length):
-                source_idx = start_pos + i
-                if source_idx >= 0 and source_idx < len(decompressed_buffer):
-                    byte_to_copy = decompressed_buffer[source_idx]
-                    decompressed_buffer.append(byte_to_copy)
-                else:
-                    print(f"Error: Relative offset {offset_relative} resulted in out of bounds read at index {source_idx}.")
-                    break
-                        
     print(f"Compressed size: 0x{comp_idx:x} ({comp_idx})")
     print(f"Total decompressed bytes: 0x{len(decompressed_buffer):x} ({len(decompressed_buffer)})")
-    percent = 100 * (1 - (comp_idx / len(decompressed_buffer)))
-    print(f"Compression percent: {percent:.2f}")
+    if decompressed_buffer:
+        percent = 100 * (1 - (comp_idx / len(decompressed_buffer)))
+        print(f"Compression percent: {percent:.2f}")
 
     return decompressed_buffer
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python script_name.py <filename> <hex_offset>")
+    args = [arg for arg in sys.argv[1:] if arg not in ('--stats', '--tiles')]
+    show_stats = '--stats' in sys.argv[1:]
+    show_tiles = '--tiles' in sys.argv[1:]
+    if len(args) != 2:
+        print("Usage: python script_name.py <filename> <hex_offset> [--stats] [--tiles]")
         print("Example: python script_name.py data.bin 0x1A00")
         sys.exit(1)
 
-    filename = sys.argv[1]
-    offset_str = sys.argv[2]
-    
+    filename = args[0]
+    offset_str = args[1]
+
     # Handle both '0x' prefixed and raw hex strings
     if offset_str.startswith('0x') or offset_str.startswith('0X'):
         offset = int(offset_str[2:], 16)
@@ -160,12 +365,30 @@ if __name__ == "__main__":
         offset = int(offset_str, 16)
 
     print(f"Attempting to decode '{filename}' starting from offset 0x{offset:X}...")
+    start = time.perf_counter()
     decoded_bytes = decompress_data_from_file(filename, offset)
-    
+    seconds = time.perf_counter() - start
+
     if decoded_bytes is not None:
         print(f"Decompression complete.")
         with open("output.bin", "wb") as f_out:
             f_out.write(decoded_bytes)
             print("Wrote output to output.bin")
-
-
+        if show_stats:
+            with open_rom(filename) as rom:
+                stats = command_stats(rom, offset)
+            stats['decompress_seconds'] = seconds
+            import cycles
+            with open_rom(filename) as rom:
+                stats['estimated_cycles'] = cycles.estimate_cycles(rom, offset)
+            print(json.dumps(stats, indent=2))
+        if show_tiles:
+            import tiles
+            unique_tiles, _ = tiles.unique(decoded_bytes)
+            flipped = set()
+            for variants in zip(*(tiles.split(v) for v in tiles.flips(unique_tiles))):
+                if not flipped.intersection(variants):
+                    flipped.add(variants[0])
+            print(f"{tiles.count(decoded_bytes)} tiles, {tiles.count(unique_tiles)} unique, "
+                  f"{len(flipped)} unique counting flipped copies")
+            print('\n'.join(tiles.render(decoded_bytes)))
@@ -0,0 +1,94 @@
+import os
+import sys
+import argparse
+
+import compress
+import sprite
+import tiles
+from tilemap import Tilemap
+
+# Removes repeated and flipped tiles from a tile set and rewrites the tilemaps or sprite table
+# that use it to point at the remaining copy, with the flip bits set.
+
+def dedupe_with_tilemaps(tileset, tilemaps, base=0, flip=True):
+    """Returns the new tileset and remaps the tilemaps (a list of Tilemap) in place."""
+    new_tileset, mapping = tiles.dedupe(tileset, flip)
+    for tilemap in tilemaps:
+        tilemap.remap_tiles(mapping, base)
+    return new_tileset
+
+def read_file(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return f.read()
+    except IOError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+def write_file(output_dir, filename, data):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, os.path.basename(filename))
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def report(name, before, after):
+    print(f"{name}: {len(before)} -> {len(after)} bytes, compressed "
+          f"{compress.estimate_size(before)} -> {compress.estimate_size(after)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove repeated and flipped tiles from a tile set.")
+    parser.add_argument('tileset')
+    parser.add_argument('--tilemap', action='append', default=[],
+                        help="a 4096/8192 byte tilemap that uses the tile set (can be repeated)")
+    parser.add_argument('--sprites', help="a sprite table that uses the tile set")
+    parser.add_argument('--base', type=lambda x: int(x, 0),
+                        help="tile number of the first tile of the set in VRAM "
+                             f"(default 0 for tilemaps, 0x{sprite.FIRST_TILE:x} for sprites)")
+    parser.add_argument('--no-flip', action='store_true', help="only remove exact repeats")
+    parser.add_argument('-o', '--output', default='deduped', help="output directory (default deduped)")
+    args = parser.parse_args()
+
+    if args.tilemap and args.sprites:
+        parser.error("give either tilemaps or a sprite table, not both")
+
+    tileset = read_file(args.tileset)
+    if len(tileset) % tiles.TILE_SIZE:
+        print(f"Error: {args.tileset} is not a whole number of tiles.")
+        sys.exit(1)
+    flip = not args.no_flip
+
+    if args.sprites:
+        table = read_file(args.sprites)
+        entries = [table[i:i + 8] for i in range(0, len(table) - len(table) % 8, 8)]
+        base = sprite.FIRST_TILE if args.base is None else args.base
+        try:
+            entries, new_tileset = sprite.dedupe_sprites(entries, tileset, base, flip)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Wrote {write_file(args.output, args.sprites, sprite.sprite_table_bytes(entries))}")
+    else:
+        base = 0 if args.base is None else args.base
+        tilemaps = []
+        for filename in args.tilemap:
+            try:
+                tilemaps.append(Tilemap.from_bytes(read_file(filename)))
+            except ValueError as e:
+                print(f"Error: {filename}: {e}")
+                sys.exit(1)
+        originals = [tilemap.to_bytes() for tilemap in tilemaps]
+        new_tileset = dedupe_with_tilemaps(tileset, tilemaps, base, flip)
+        for filename, original, tilemap in zip(args.tilemap, originals, tilemaps):
+            report(filename, original, tilemap.to_bytes())
+            print(f"Wrote {write_file(args.output, filename, tilemap.to_bytes())}")
+        if not tilemaps:
+            print("No tilemaps or sprite table given, so this only shows what could be saved.")
+
+    print(f"Tiles: {tiles.count(tileset)} -> {tiles.count(new_tileset)}")
+    report(args.tileset, tileset, new_tileset)
+    if args.tilemap or args.sprites:
+        print(f"Wrote {write_file(args.output, args.tileset, new_tileset)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import sys
+import os
+import argparse
+
+# One entry point for the tools. Stages are separated by '+' and each one works on the results of
+# the one before, in memory:
+#
+#   python dnd.py encode es/intro1_es.txt es/intro2_es.txt + compress --optimal + patch dnd.md 0x5108c 0x5122c
+#
+# The tool modules are only imported by the stages that use them, so starting up stays quick.
+# Results are passed along as a list of (name, data) pairs. If the last stage doesn't write them
+# anywhere (write or patch), they are written to files named after them.
+
+def parse_offset(text):
+    return int(text, 16)
+
+def base_name(filename):
+    name = os.path.basename(filename)
+    return os.path.splitext(name)[0]
+
+def read_files(filenames):
+    items = []
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            items.append((base_name(filename) + '.bin', f.read()))
+    return items
+
+def inputs(args, items, reader=read_files):
+    # A stage works on the files it was given, or else on what the previous stage produced.
+    if args.files:
+        return reader(args.files)
+    if items is None:
+        raise ValueError(f"{args.stage} needs input files or a stage before it")
+    return items
+
+def stage_read(args, items):
+    return read_files(args.files)
+
+def stage_decompress(args, items):
+    import assets
+    results = []
+    for offset in args.offsets:
+        data = assets.decompressed(args.rom_path, offset)
+        print(f"0x{offset:x}: {len(data)} bytes")
+        results.append((f"{base_name(args.rom_path)}_{offset:x}.bin", data))
+    return results
+
+def stage_compress(args, items):
+    import compress
+    results = []
+    for name, data in inputs(args, items):
+        compressed_data = compress.compress_optimal(data, args.span, args.optimal or bool(args.speed),
+                                                    args.lazy, args.prefer_relative, speed=args.speed,
+                                                    tilemap=args.tilemap)
+        print(f"{name}: {len(data)} bytes -> {len(compressed_data)} bytes")
+        results.append((base_name(name) + '.compressed', bytes(compressed_data)))
+    return results
+
+def stage_encode(args, items):
+    import encode
+    results = []
+    for filename in args.files:
+        lines = encode.read_text_lines(filename)
+        if args.optimize:
+            data, size, _ = encode.optimize_layout(lines, args.max_shift)
+            print(f"{filename}: best layout compresses to {size} bytes")
+        else:
+            data = encode.encode_tilemap(lines).to_bytes()
+        results.append((base_name(filename) + '.bin', bytes(data)))
+    return results
+
+def stage_sprite(args, items):
+    import sprite
+    results = []
+    for filename in args.files:
+        with open(filename, 'r') as f:
+            text = f.read()
+        sprite_entries, tiles_needed_string = sprite.generate_sprite_table_and_tiles_flexible_spaces(text, verbose=False)
+        font_data = sprite.load_font()
+        if args.optimize:
+            sprite_entries, tiles_needed_string = sprite.optimize_sprites(text, font_data, verbose=False)
+        if len(tiles_needed_string) > sprite.MAX_TILES or len(sprite_entries) > sprite.MAX_SPRITES:
+            raise ValueError(f"{filename}: {len(tiles_needed_string)} tiles and {len(sprite_entries)} sprites, "
+                             f"the limits are {sprite.MAX_TILES} and {sprite.MAX_SPRITES}.")
+        if args.table:
+            print(f"{filename}: {len(sprite_entries)} sprites")
+            results.append((base_name(filename) + '_table.bin', sprite.sprite_table_bytes(sprite_entries)))
+        else:
+            print(f"{filename}: {len(tiles_needed_string)} tiles")
+            tileset = sprite.build_tileset(tiles_needed_string, font_data, sprite.fontorder, sprite.fontoffset)
+            results.append((base_name(filename) + '_tileset.bin', bytes(tileset)))
+    return results
+
+def stage_patch(args, items):
+    import mmap
+    import build
+    items = inputs(args, items)
+    if len(args.offsets) != len(items):
+        raise ValueError(f"patch got {len(items)} blocks but {len(args.offsets)} offsets")
+    # 'auto' budgets are the size of the original block, shared with build.py through its state
+    # file so that they don't shrink to whatever was patched in last time.
+    state_path = os.path.join(args.build_dir, 'state.json')
+    state = build.load_state(state_path)
+    with open(args.rom_path, 'r+b') as f, mmap.mmap(f.fileno(), 0) as rom:
+        # Check everything first so that nothing is written unless it all fits.
+        for (name, data), offset in zip(items, args.offsets):
+            budget = args.budget
+            if budget == 'auto':
+                try:
+                    budget = build.entry_budget(rom, state, name, offset, None)
+                except ValueError as e:
+                    raise ValueError(f"{e} Give --budget.")
+            if budget != 'none' and len(data) > int(budget):
+                raise ValueError(f"{name} is {len(data)} bytes, {len(data) - int(budget)} over the {budget} bytes at 0x{offset:x}")
+        if args.budget == 'auto':
+            os.makedirs(args.build_dir, exist_ok=True)
+            build.save_state(state_path, state)
+        for (name, data), offset in zip(items, args.offsets):
+            rom[offset:offset + len(data)] = data
+            print(f"Patched {name} ({len(data)} bytes) at 0x{offset:x}")
+        rom.flush()
+    return []
+
+def stage_write(args, items):
+    items = inputs(args, items)
+    os.makedirs(args.output, exist_ok=True)
+    for name, data in items:
+        path = os.path.join(args.output, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        print(f"Wrote {path} ({len(data)} bytes)")
+    return []
+
+def check_compress(parser, args):
+    # The same checks as compress.py, so both accept the same options.
+    if args.tilemap and (args.optimal or args.speed):
+        parser.error("--tilemap can't be combined with --optimal or --speed.")
+    if args.speed < 0:
+        parser.error("--speed can't be negative.")
+    if args.span < 3 or args.span > 10:
+        parser.error("Minimum span must be between 3 and 10.")
+
+def budget_value(text):
+    return text if text in ('auto', 'none') else int(text, 0)
+
+def stage_parsers():
+    parsers = {}
+    def add(name, function, description, check=None):
+        parser = argparse.ArgumentParser(prog=f"dnd.py {name}", description=description)
+        parser.set_defaults(function=function, stage=name, check=check)
+        parsers[name] = parser
+        return parser
+
+    p = add('read', stage_read, "Read files as they are.")
+    p.add_argument('files', nargs='+')
+
+    p = add('decompress', stage_decompress, "Decompress blocks from a ROM.")
+    p.add_argument('rom_path')
+    p.add_argument('offsets', nargs='+', type=parse_offset, metavar='offset')
+
+    p = add('compress', stage_compress, "Compress files, or the previous stage's results.", check_compress)
+    p.add_argument('files', nargs='*')
+    p.add_argument('--span', type=int, default=3, help="minimum span, 3-10")
+    p.add_argument('--optimal', action='store_true')
+    p.add_argument('--lazy', action='store_true')
+    p.add_argument('--prefer-relative', action='store_true')
+    p.add_argument('--speed', type=float, default=0)
+    p.add_argument('--tilemap', action='store_true', help="fast mode for tilemaps")
+
+    p = add('encode', stage_encode, "Encode text screens as tilemaps.")
+    p.add_argument('files', nargs='+')
+    p.add_argument('--optimize', action='store_true')
+    p.add_argument('--max-shift', type=int, default=1)
+
+    p = add('sprite', stage_sprite, "Build the game over tileset (or with --table, the sprite table) from text.")
+    p.add_argument('files', nargs='+')
+    p.add_argument('--table', action='store_true', help="produce the sprite table instead of the tileset")
+    p.add_argument('--optimize', action='store_true')
+
+    p = add('patch', stage_patch, "Write the previous stage's results (or files) into a ROM, one per offset.")
+    p.add_argument('rom_path')
+    p.add_argument('offsets', nargs='+', type=parse_offset, metavar='offset')
+    p.add_argument('--files', nargs='+', default=None)
+    p.add_argument('--budget', type=budget_value, default='auto',
+                   help="most bytes each block may take: a number, 'auto' (the size of the block "
+                        "originally there, the default) or 'none'")
+    p.add_argument('--build-dir', default='build',
+                   help="where the original block sizes for 'auto' are kept, shared with build.py (default: build)")
+
+    p = add('write', stage_write, "Write the previous stage's results to files.")
+    p.add_argument('files', nargs='*', help=argparse.SUPPRESS)
+    p.add_argument('-o', '--output', default='.', help="directory to write to (default: current)")
+    return parsers
+
+def split_stages(argv):
+    stages = [[]]
+    for arg in argv:
+        if arg == '+':
+            stages.append([])
+        else:
+            stages[-1].append(arg)
+    return stages
+
+def main(argv):
+    parsers = stage_parsers()
+    stages = split_stages(argv)
+    if not stages[0] or stages[0][0] in ('-h', '--help') or any(not stage or stage[0] not in parsers for stage in stages):
+        print("Usage: python dnd.py <stage> [options] [+ <stage> [options]]...")
+        print(f"Stages: {', '.join(parsers)}. Use 'python dnd.py <stage> -h' for a stage's options.")
+        print("Example: python dnd.py encode es/intro1_es.txt + compress --optimal + patch dnd.md 0x5108c")
+        return 1
+    parsed = [parsers[stage[0]].parse_args(stage[1:]) for stage in stages]
+    for args in parsed:
+        if args.check:
+            args.check(parsers[args.stage], args)
+
+    items = None
+    try:
+        for args in parsed:
+            items = args.function(args, items)
+        if items:
+            stage_write(argparse.Namespace(files=[], output='.', stage='write'), items)
+    except (IOError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,5 +1,20 @@
 import sys
 import os
+import argparse
+from array import array
+from tilemap import Tilemap
+
+# Bump whenever a change alters the tilemap produced for the same text.
+ENCODER_VERSION = 1
+
+SCREEN_WIDTH = 64
+VISIBLE_WIDTH = 40
+VISIBLE_HEIGHT = 28
+
+# optimize_layout scores this many attribute and shift combinations exactly, and indent moves
+# whose fast estimate is within this many bytes of the current layout.
+LAYOUT_FINALISTS = 3
+QUICK_ESTIMATE_SLACK = 4
 
 # --- Tile Definitions (Mapping Characters to Tile IDs) ---
 
@@ -49,19 +64,40 @@ def get_char_tiles(char):
     # Default to a space if character is not found
     return [0x00], [0x00], 1, False # Unknown char is a 1-wide blank space
 
-def encode_text_to_tiles(text_lines):
+# Words for each character's top and bottom rows, keyed by (character, word used for blank tiles).
+_glyph_words = {}
+
+def glyph_words(char, blank_word):
+    """
+    The tilemap words for char as (top, bottom, width, is_double_height). Visible tiles use
+    palette 1 (attribute 0x20); blank tiles get blank_word.
+    """
+    key = (char, blank_word)
+    glyph = _glyph_words.get(key)
+    if glyph is None:
+        top_tiles, bottom_tiles, width, is_double_height = get_char_tiles(char)
+        top = array('H', [0x2000 | t if t else blank_word for t in top_tiles])
+        bottom = array('H', [0x2000 | t if t else blank_word for t in bottom_tiles])
+        glyph = _glyph_words[key] = (top, bottom, width, is_double_height)
+    return glyph
+
+def encode_tilemap(text_lines, blank_attr=0x00, hidden_attr=None):
     """
-    Encodes text into a flat list of tile_id bytes only.
+    Encodes text into a 64x32 Tilemap.
     Handles line breaks, variable character width, and vertical spacing.
+    blank_attr is the attribute byte of blank tiles on screen and hidden_attr (default: the same)
+    the one for the columns and rows that are never shown. Both are invisible either way.
     """
-    SCREEN_WIDTH = 64
-    SCREEN_HEIGHT = 32 # Adjusted height for 4096 bytes (2048 entries) if we ignore attributes
-    VISIBLE_WIDTH = 40
-    TOTAL_ENTRIES = SCREEN_WIDTH * SCREEN_HEIGHT # 2048 entries
+    SCREEN_HEIGHT = 32
+
+    if hidden_attr is None:
+        hidden_attr = blank_attr
+    tilemap = Tilemap(SCREEN_HEIGHT)
+    tilemap.fill(hidden_attr << 8)
+    tilemap.fill(blank_attr << 8, 0, 0, VISIBLE_WIDTH, VISIBLE_HEIGHT)
+    # Characters only ever go in the visible columns, so the blank word just depends on the row.
+    blank_words = [blank_attr << 8 if y < VISIBLE_HEIGHT else hidden_attr << 8 for y in range(SCREEN_HEIGHT)]
 
-    # Initialize the virtual screen with blank tile IDs (0x00)
-    screen_tiles = [0x00] * TOTAL_ENTRIES 
-    
     current_x = 0
     current_y = 0
 
@@ -69,39 +105,26 @@ def encode_text_to_tiles(text_lines):
         if line.startswith('#'):
             continue
 
-        line_height_needed = 1 # Start assuming a single height line
-        
-        # Pre-check the line to determine if it contains any double-height characters
-        for char in line:
-            _, _, _, is_double_height = get_char_tiles(char)
-            if is_double_height:
-                line_height_needed = 2
-                break
-        
+        # A line with any double-height character takes two rows.
+        line_height_needed = 2 if any(glyph_words(char, 0)[3] for char in line) else 1
+
         # Process characters in the line
         for char in line:
-            top_tiles, bottom_tiles, width, _ = get_char_tiles(char)
+            width = glyph_words(char, 0)[2]
 
             if current_x + width > VISIBLE_WIDTH:
                 # Wrap to the next line of required height
                 current_x = 0
                 current_y += line_height_needed
-                if current_y >= SCREEN_HEIGHT: break 
-            
+                if current_y >= SCREEN_HEIGHT: break
+
             # Place top tiles in the current row
-            for i, tile_id in enumerate(top_tiles):
-                index = current_y * SCREEN_WIDTH + current_x + i
-                if index < TOTAL_ENTRIES:
-                    screen_tiles[index] = tile_id
+            tilemap.set_row(current_y, current_x, glyph_words(char, blank_words[current_y])[0])
 
             # If the line needs 2 tiles of vertical space, place bottom tiles in the row below
-            if line_height_needed == 2:
-                for i, tile_id in enumerate(bottom_tiles):
-                    if current_y + 1 < SCREEN_HEIGHT:
-                        index = (current_y + 1) * SCREEN_WIDTH + current_x + i
-                        if index < TOTAL_ENTRIES:
-                            screen_tiles[index] = tile_id
-            
+            if line_height_needed == 2 and current_y + 1 < SCREEN_HEIGHT:
+                tilemap.set_row(current_y + 1, current_x, glyph_words(char, blank_words[current_y + 1])[1])
+
             current_x += width
 
         # After finishing an input line, move the cursor down
@@ -109,33 +132,154 @@ def encode_text_to_tiles(text_lines):
         current_y += line_height_needed
         if current_y >= SCREEN_HEIGHT: break
 
-    return screen_tiles
+    return tilemap
+
+def encode_text_to_tiles(text_lines):
+    """Encodes text into a flat list of tile_id bytes only."""
+    return encode_tilemap(text_lines).tile_ids()
+
+def tilemap_bytes(tile_ids, blank_attr=0x00, hidden_attr=None):
+    """
+    Interleaves the attribute byte (0x20 if visible, blank_attr or hidden_attr if blank) with
+    each tile ID of a list from encode_text_to_tiles.
+    """
+    if hidden_attr is None:
+        hidden_attr = blank_attr
+    tile_bytes = bytes(tile_ids)
+    # Translate each tile ID straight to its attribute, then redo the off-screen cells.
+    visible_table = bytes([blank_attr] + [0x20] * 255)
+    hidden_table = bytes([hidden_attr] + [0x20] * 255)
+    attributes = bytearray(tile_bytes.translate(visible_table))
+    for y in range(len(tile_bytes) // SCREEN_WIDTH):
+        start = y * SCREEN_WIDTH + (0 if y >= VISIBLE_HEIGHT else VISIBLE_WIDTH)
+        end = (y + 1) * SCREEN_WIDTH
+        attributes[start:end] = tile_bytes[start:end].translate(hidden_table)
+
+    byte_data = bytearray(2 * len(tile_bytes))
+    byte_data[0::2] = attributes
+    byte_data[1::2] = tile_bytes
+    return byte_data
+
+def line_width(line):
+    return sum(get_char_tiles(char)[2] for char in line)
+
+def centered_odd_lines(text_lines):
+    """
+    Lines that are centered but have an odd number of spare tiles, so the extra tile could go
+    on either side. Returns (index, True if the extra tile is currently on the left) pairs.
+    """
+    lines = []
+    for index, line in enumerate(text_lines):
+        content = line.strip(' ')
+        if not content or line.startswith('#'):
+            continue
+        indent = len(line) - len(line.lstrip(' '))
+        spare = VISIBLE_WIDTH - line_width(content)
+        if spare % 2 and indent in (spare // 2, spare // 2 + 1):
+            lines.append((index, indent == spare // 2 + 1))
+    return lines
+
+def shift_lines(text_lines, rows):
+    """Moves the text down (or up, if rows is negative) by adding or removing blank lines at the top."""
+    if rows >= 0:
+        return [''] * rows + list(text_lines)
+    if any(line != '' for line in text_lines[:-rows]):
+        return None
+    return list(text_lines[-rows:])
+
+def fits_on_screen(tilemap):
+    return not any(tilemap.row_has_tiles(y) for y in range(VISIBLE_HEIGHT, tilemap.height))
+
+def optimize_layout(text_lines, max_shift=1, estimate=None, quick_estimate=None,
+                    finalists=LAYOUT_FINALISTS, slack=QUICK_ESTIMATE_SLACK):
+    """
+    Tries variants of the screen that look the same (or, for the shifts, almost the same) and
+    returns the one that compresses smallest as (byte_data, compressed size, settings).
+    Variants are the attribute of blank tiles on screen and off screen, moving the text up or down
+    by up to max_shift rows, and which side gets the extra tile on centered lines with an odd
+    number of spare tiles. estimate defaults to the exact optimal compressed size.
+    Every variant is first ranked by quick_estimate (default: the size of the fast tilemap parse),
+    and only the best few are scored with estimate: the top finalists attribute and shift
+    combinations, and indent moves that come within slack bytes of the current layout.
+    """
+    if estimate is None or quick_estimate is None:
+        import compress
+        estimate = estimate or compress.estimate_size
+        quick_estimate = quick_estimate or compress.quick_estimate_size
+
+    def variant(lines, shift, blank_attr, hidden_attr):
+        shifted = shift_lines(lines, shift)
+        if shifted is None:
+            return None
+        tilemap = encode_tilemap(shifted, blank_attr, hidden_attr)
+        if not fits_on_screen(tilemap):
+            return None
+        byte_data = tilemap.to_bytes()
+        return quick_estimate(byte_data), byte_data
+
+    # The attributes and the shift interact, so try every combination of those first...
+    # The unchanged layout goes first so that it wins ties, and is always a finalist.
+    ranked = []
+    for shift in sorted(range(-max_shift, max_shift + 1), key=abs):
+        for blank_attr in (0x00, 0x20):
+            for hidden_attr in (0x00, 0x20):
+                result = variant(text_lines, shift, blank_attr, hidden_attr)
+                if result:
+                    order = len(ranked)
+                    ranked.append(result + (order, {'shift': shift, 'blank_attr': blank_attr, 'hidden_attr': hidden_attr}))
+
+    if not ranked:
+        raise ValueError(f"The text doesn't fit in the {VISIBLE_HEIGHT} visible rows")
+
+    chosen = sorted(ranked, key=lambda result: (result[0], result[2]))[:finalists]
+    if ranked[0] not in chosen:
+        chosen.append(ranked[0])
+    size, order, quick, byte_data, settings = min(
+        (estimate(byte_data), order, quick, byte_data, settings) for quick, byte_data, order, settings in chosen)
+
+    # ...then move the extra tile of each odd line across while that helps.
+    lines = list(text_lines)
+    settings = dict(settings, moved_lines=[])
+    improved = True
+    while improved:
+        improved = False
+        for index, on_left in centered_odd_lines(lines):
+            if index in settings['moved_lines']:
+                continue
+            candidate = list(lines)
+            candidate[index] = candidate[index][1:] if on_left else ' ' + candidate[index]
+            result = variant(candidate, settings['shift'], settings['blank_attr'], settings['hidden_attr'])
+            if not result or result[0] > quick + slack:
+                continue
+            candidate_size = estimate(result[1])
+            if candidate_size < size:
+                quick, byte_data = result
+                size = candidate_size
+                lines = candidate
+                settings['moved_lines'].append(index)
+                improved = True
+
+    return byte_data, size, settings
+
+def read_text_lines(input_filename):
+    with open(input_filename, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    return [line.replace('\r', '').replace('\n', '') for line in lines]
 
 def save_binary_file(input_filename, tile_ids):
-    """Saves the list of tile_id bytes to a binary file, prepending an 0x00 attribute byte."""
+    """Saves a Tilemap, tilemap bytes or a list of tile IDs (with 0x00 attributes for blanks) to a binary file."""
     output_filename = input_filename
     if output_filename.lower().endswith('.txt'):
         output_filename = output_filename[:-4] + '.bin'
     else:
         output_filename += '.bin'
     
-    # We must interleave the attribute byte (0x20 if visible, 0x00 if blank)
-    # The current encode_text_to_tiles only returns tile IDs. 
-    # Let's adjust this to recreate the required 2-byte structure for the *output*.
-    
-    # Wait, the user said the final file must be 4096 bytes long. 
-    # That means we cannot interleave attribute bytes if the grid is 64x64. 
-    # The only way to get a 4096 byte file is a 64x64 grid with 1 byte per tile, 
-    # OR a 64x32 grid with 2 bytes per tile (attribute + tile ID).
-
-    # The user is likely constrained by the 4096 byte *size* limit in their game memory slot. 
-    # I'll stick with the 64x32 (2048 tile entries total) structure and interleave the attribute bytes to reach 4096 bytes total.
-
-    byte_data = bytearray()
-    for tile_id in tile_ids: # tile_ids is 2048 entries long
-        attr = 0x20 if tile_id != 0x00 else 0x00
-        byte_data.append(attr)
-        byte_data.append(tile_id)
+    if isinstance(tile_ids, Tilemap):
+        byte_data = tile_ids.to_bytes()
+    elif isinstance(tile_ids, (bytes, bytearray)):
+        byte_data = tile_ids
+    else:
+        byte_data = tilemap_bytes(tile_ids)
 
     with open(output_filename, 'wb') as f:
         f.write(byte_data)
@@ -143,27 +287,68 @@ def save_binary_file(input_filename, tile_ids):
     print(f"Successfully encoded text and saved to {output_filename}")
     print(f"Total bytes written: {len(byte_data)} (Targeting exactly 4096 bytes for a 64x32 grid)")
 
-def main():
-    if len(sys.argv) != 2:
-        print(f"Usage: python {sys.argv[0]} <input_text_filename>")
-        sys.exit(1)
-
-    input_filename = sys.argv[1] # Corrected index access
-
+def encode_file(input_filename, optimize=False, max_shift=1):
     try:
-        with open(input_filename, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            lines = [line.replace('\r', '').replace('\n', '') for line in lines]
+        lines = read_text_lines(input_filename)
     except FileNotFoundError:
         print(f"Error: Input file '{input_filename}' not found.")
         sys.exit(1)
     except Exception as e:
         print(f"An error occurred reading the file: {e}")
         sys.exit(1)
-    
-    encoded_tile_ids = encode_text_to_tiles(lines)
-    save_binary_file(input_filename, encoded_tile_ids)
+
+    if optimize:
+        try:
+            byte_data, size, settings = optimize_layout(lines, max_shift)
+        except ValueError as e:
+            print(f"Error: Can't optimize '{input_filename}': {e}")
+            return False
+        moved = ', '.join(str(index + 1) for index in sorted(settings['moved_lines'])) or 'none'
+        print(f"Smallest layout compresses to {size} bytes: shifted {settings['shift']} rows, "
+              f"blank attribute 0x{settings['blank_attr']:02x}, hidden attribute 0x{settings['hidden_attr']:02x}, "
+              f"extra indent moved on lines: {moved}")
+        save_binary_file(input_filename, byte_data)
+        return True
+
+    save_binary_file(input_filename, encode_tilemap(lines))
+    return True
+
+def has_directives(input_filename):
+    # Sprite texts like game_over.txt start with @filename and friends; screens never do.
+    with open(input_filename, 'r', encoding='utf-8') as f:
+        return any(line.lstrip().startswith('@') for line in f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode a text screen as a 64x32 tilemap.")
+    parser.add_argument('input_text_filename', nargs='?')
+    parser.add_argument('--batch', metavar='DIRECTORY',
+                        help="encode every screen text (.txt without @ directives) in the directory")
+    parser.add_argument('--optimize', action='store_true',
+                        help="pick the layout variant that compresses smallest")
+    parser.add_argument('--max-shift', type=int, default=1,
+                        help="with --optimize, how many rows the text may move up or down (default 1)")
+    args = parser.parse_args()
+
+    if args.batch:
+        try:
+            names = sorted(name for name in os.listdir(args.batch) if name.lower().endswith('.txt'))
+            skipped = [name for name in names if has_directives(os.path.join(args.batch, name))]
+        except OSError as e:
+            print(f"Error: Can't read directory '{args.batch}': {e}")
+            sys.exit(1)
+        if skipped:
+            print(f"Skipping {', '.join(skipped)}: @ directives mean a sprite text, not a screen")
+            names = [name for name in names if name not in skipped]
+        failed = [name for name in names if not encode_file(os.path.join(args.batch, name), args.optimize, args.max_shift)]
+        if failed:
+            print(f"Failed: {', '.join(failed)}")
+            sys.exit(1)
+        return
+
+    if args.input_text_filename is None:
+        parser.error("give an input file or --batch DIRECTORY")
+    if not encode_file(args.input_text_filename, args.optimize, args.max_shift):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
-
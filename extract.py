@@ -0,0 +1,130 @@
+import sys
+import os
+import json
+import mmap
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import decompress
+
+KINDS = ('tilemap', 'tiles', 'data', 'raw')
+
+def read_manifest(filename):
+    """
+    Reads a manifest of known blocks (see assets.txt).
+    Returns a list of (offset, kind, name, length) tuples. length is None for compressed blocks.
+    """
+    entries = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) < 3 or fields[1] not in KINDS:
+                raise ValueError(f"{filename}:{line_number}: expected '<offset> <kind> <name> [length]' with kind one of {', '.join(KINDS)}")
+            offset = int(fields[0], 16)
+            kind, name = fields[1], fields[2]
+            length = None
+            if kind == 'raw':
+                if len(fields) < 4:
+                    raise ValueError(f"{filename}:{line_number}: raw blocks need a length")
+                length = int(fields[3], 16)
+            entries.append((offset, kind, name, length))
+    return entries
+
+# Each worker process maps the ROM once and decodes every entry it is given from that view.
+worker_rom = None
+
+def open_worker_rom(rom_path):
+    global worker_rom
+    with open(rom_path, 'rb') as f:
+        worker_rom = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def extract_entry(entry):
+    offset, kind, name, length = entry
+    if kind == 'raw':
+        if offset + length > len(worker_rom):
+            raise ValueError("Raw block runs past the end of the ROM.")
+        return worker_rom[offset:offset+length], length
+    data, consumed = decompress.decompress(worker_rom, offset)
+    return bytes(data), consumed
+
+def run_entry(entry):
+    try:
+        data, consumed = extract_entry(entry)
+        return data, consumed, None
+    except ValueError as e:
+        return None, None, str(e)
+
+def check_size(kind, size):
+    if kind == 'tilemap' and size not in (4096, 8192):
+        return "a tilemap should be 4096 or 8192 bytes"
+    if kind == 'tiles' and size % 32:
+        return "tiles should be a multiple of 32 bytes"
+    return None
+
+def extract_all(rom_path, entries, output_dir, jobs=None):
+    """
+    Extracts every manifest entry from the ROM into output_dir as <name>.bin and writes
+    index.json with the compressed size and end offset of each block.
+    Returns the index (a list of dicts).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if jobs == 1:
+        open_worker_rom(rom_path)
+        results = [run_entry(entry) for entry in entries]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=open_worker_rom, initargs=(rom_path,)) as pool:
+            results = list(pool.map(run_entry, entries))
+
+    index = []
+    for (offset, kind, name, _), (data, consumed, error) in zip(entries, results):
+        item = {'name': name, 'kind': kind, 'offset': f"0x{offset:x}"}
+        if error is not None:
+            item['error'] = error
+        else:
+            with open(os.path.join(output_dir, name + '.bin'), 'wb') as f_out:
+                f_out.write(data)
+            item.update({
+                'compressed_size': consumed,
+                'end_offset': f"0x{offset + consumed:x}",
+                'size': len(data),
+            })
+            warning = check_size(kind, len(data))
+            if warning:
+                item['warning'] = warning
+        index.append(item)
+
+    with open(os.path.join(output_dir, 'index.json'), 'w') as f_out:
+        json.dump(index, f_out, indent=2)
+    return index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract every known block from a ROM in one go.",
+                                     epilog="Example: python extract.py dnd.md assets.txt -o extracted")
+    parser.add_argument('rom_path')
+    parser.add_argument('manifest', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets.txt'))
+    parser.add_argument('-o', '--output-dir', default='extracted')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    try:
+        entries = read_manifest(args.manifest)
+        index = extract_all(args.rom_path, entries, args.output_dir, args.jobs)
+    except (IOError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    failed = 0
+    for item in index:
+        if 'error' in item:
+            failed += 1
+            print(f"{item['offset']:>9} {item['name']:<28} Error: {item['error']}")
+            continue
+        line = f"{item['offset']:>9} {item['name']:<28} {item['size']:6} bytes from {item['compressed_size']:5} (ends at {item['end_offset']})"
+        if 'warning' in item:
+            line += f" Warning: {item['warning']}"
+        print(line)
+    print(f"Wrote {len(index) - failed} blocks and index.json to {args.output_dir}")
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,275 @@
+import sys
+import os
+import random
+import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import compress
+import decompress
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Round-trip fuzzing for the codec: every generated input is compressed with several strategies,
+# and each result is decoded by decompress.py and by the plain reference decoder below, which must
+# agree with each other and with the input. Failures are shrunk to a small input that still fails.
+
+# Strategies every case is compressed with; one greedy minimum span is picked per case as well.
+STRATEGIES = [
+    {'minimum_span': compress.MINIMUM_SPAN},
+    {'minimum_span': compress.MINIMUM_SPAN, 'lazy': True},
+    {'minimum_span': compress.MINIMUM_SPAN, 'prefer_relative': True},
+    {'minimum_span': compress.MINIMUM_SPAN, 'optimal': True},
+    {'minimum_span': compress.MINIMUM_SPAN, 'optimal': True, 'speed': 50},
+    {'minimum_span': compress.MINIMUM_SPAN, 'tilemap': True},
+]
+
+MAX_INPUT = compress.MAX_INPUT_SIZE
+MAX_RELATIVE_OFFSET = compress.MAX_RELATIVE_OFFSET
+MAX_SHRINK_CHECKS = 2000 # Round trips one failure may take to shrink
+
+def reference_decompress(buffer, offset=0):
+    """
+    Decodes one byte at a time, the way the game does, with nothing shared with decompress.py.
+    Returns (output, consumed). Raises ValueError for malformed data.
+    """
+    out = bytearray()
+    i = offset
+    def byte():
+        nonlocal i
+        if i >= len(buffer):
+            raise ValueError("ran out of data")
+        i += 1
+        return buffer[i - 1]
+    def copy(source, length):
+        if source < 0 or source >= len(out):
+            raise ValueError(f"copy from {source} with {len(out)} bytes of output")
+        for k in range(length):
+            out.append(out[source + k])
+    while True:
+        control = byte()
+        if control == 0x80:
+            return out, i - offset
+        if control == 0xfe:
+            length = byte() | byte() << 8
+            out.extend([byte()] * length)
+        elif control == 0xff:
+            length = byte() | byte() << 8
+            copy(byte() | byte() << 8, length)
+        elif control >= 0xc0:
+            copy(byte() | byte() << 8, (control & 0x3f) + 3)
+        elif control >= 0x80:
+            for _ in range(control & 0x3f):
+                out.append(byte())
+        else:
+            low = byte()
+            distance = (control & 0x0f) << 8 | low
+            if distance == 0:
+                raise ValueError("relative copy with distance 0")
+            copy(len(out) - distance, (control >> 4) + 3)
+
+def generate(seed):
+    """A test input. Mostly built from pieces aimed at the format's limits, sometimes plain random."""
+    r = random.Random(seed)
+    size = r.choice((r.randrange(1, 64), r.randrange(64, 0x1000), r.randrange(0x1000, 0x4000), r.randrange(0x4000, MAX_INPUT + 1)))
+    if r.random() < 0.1:
+        return r.randbytes(size)
+    alphabet = r.randbytes(r.choice((1, 2, 4, 16, 256)))
+    data = bytearray()
+    while len(data) < size:
+        piece = r.randrange(8)
+        if piece == 0: # raw runs around MAX_RAW_LENGTH
+            data += r.randbytes(r.choice((1, 2, 62, 63, 64, 65, 126, 127, 128, r.randrange(1, 200))))
+        elif piece == 1: # fills around one and two byte lengths
+            data += bytes((r.choice(alphabet),)) * r.choice((1, 2, 3, 255, 256, 257, 0x1000, r.randrange(1, 600)))
+        elif piece == 2 and data: # repeats at the edge of the relative window
+            distance = min(len(data), r.choice((1, 2, MAX_RELATIVE_OFFSET - 1, MAX_RELATIVE_OFFSET,
+                                                   MAX_RELATIVE_OFFSET + 1, MAX_RELATIVE_OFFSET + 2, r.randrange(1, 0x2000))))
+            length = r.choice((3, 4, 10, 11, 12, r.randrange(3, 80)))
+            for _ in range(length):
+                data.append(data[-distance])
+        elif piece == 3 and data: # copies around the absolute/long boundary
+            length = r.choice((compress.MAX_ABSOLUTE_LENGTH - 1, compress.MAX_ABSOLUTE_LENGTH,
+                               compress.MAX_ABSOLUTE_LENGTH + 1, compress.MAX_ABSOLUTE_LENGTH + 2, r.randrange(3, 600)))
+            source = r.randrange(len(data))
+            for k in range(length):
+                data.append(data[source + k])
+        elif piece == 4: # tilemap-like words
+            word = struct.pack('>H', r.choice((0, 0x2000)) | r.randrange(0x100))
+            data += word * r.randrange(1, 80)
+        elif piece == 5: # tile-like rows
+            data += bytes(r.choice(alphabet) & r.choice((0x0f, 0xf0, 0xff)) for _ in range(32))
+        else:
+            data += bytes(r.choice(alphabet) for _ in range(r.randrange(1, 100)))
+    return bytes(data[:size])
+
+def check(data, strategy):
+    """Returns None if data round trips with strategy, otherwise what went wrong."""
+    try:
+        compressed_data = bytes(compress.compress_optimal(data, **strategy))
+    except Exception as e:
+        return f"compressor raised {type(e).__name__}: {e}"
+    try:
+        decoded, consumed = decompress.decompress(compressed_data)
+    except ValueError as e:
+        return f"decompress.py rejected the output: {e}"
+    try:
+        reference, reference_consumed = reference_decompress(compressed_data)
+    except ValueError as e:
+        return f"reference decoder rejected the output: {e}"
+    if decoded != reference or consumed != reference_consumed:
+        return "decompress.py and the reference decoder disagree"
+    if consumed != len(compressed_data):
+        return f"terminator at {consumed} of {len(compressed_data)} bytes"
+    if decoded != data:
+        mismatch = next((i for i, (a, b) in enumerate(zip(decoded, data)) if a != b), min(len(decoded), len(data)))
+        return f"round trip differs at byte {mismatch} (decoded {len(decoded)} of {len(data)} bytes)"
+    return None
+
+def run_case(seed):
+    data = generate(seed)
+    strategies = STRATEGIES + [{'minimum_span': random.Random(seed).randrange(3, 11)}]
+    for strategy in strategies:
+        problem = check(data, strategy)
+        if problem:
+            return seed, strategy, problem
+    return None
+
+def run_cases(seeds):
+    return [failure for failure in map(run_case, seeds) if failure]
+
+def shrink(data, strategy, max_checks=MAX_SHRINK_CHECKS):
+    """
+    Removes and simplifies parts of data while it still fails, to get a small reproducer.
+    Works in halving chunks, and stops trying after max_checks round trips.
+    """
+    checks = 0
+    def fails(candidate):
+        nonlocal checks
+        checks += 1
+        return check(candidate, strategy)
+
+    chunk = len(data) // 2
+    while chunk >= 1 and checks < max_checks:
+        start = 0
+        while start < len(data) and checks < max_checks:
+            candidate = data[:start] + data[start + chunk:]
+            if candidate and fails(candidate):
+                data = candidate
+            else:
+                start += chunk
+        chunk //= 2
+    # Then make bytes zero where that doesn't matter, in the same halving chunks.
+    chunk = max(len(data) // 2, 1)
+    while chunk >= 1 and checks < max_checks:
+        for start in range(0, len(data), chunk):
+            if checks >= max_checks:
+                break
+            if any(data[start:start + chunk]):
+                candidate = data[:start] + bytes(len(data[start:start + chunk])) + data[start + chunk:]
+                if fails(candidate):
+                    data = candidate
+        chunk //= 2
+    return data
+
+def shrink_failure(failure):
+    seed, strategy, _ = failure
+    return shrink(generate(seed), strategy)
+
+def check_tiles():
+    """Checks tiles.py on buffers from empty to a few tiles, including partial tiles. Returns a list of problems."""
+    import tiles
+    problems = []
+    r = random.Random(0)
+    for size in (0, 1, 31, 32, 33, 64, 95, 17 * tiles.TILE_SIZE):
+        data = r.randbytes(size)
+        whole = data[:tiles.count(data) * tiles.TILE_SIZE]
+        try:
+            if tiles.pack(tiles.unpack(data)) != whole:
+                problems.append(f"tiles: unpacking and packing {size} bytes doesn't round trip")
+            if tiles.hflip(tiles.hflip(data)) != whole or tiles.vflip(tiles.vflip(data)) != whole:
+                problems.append(f"tiles: flipping {size} bytes twice doesn't give them back")
+            if len(tiles.render(data)) != 9 * -(-tiles.count(data) // 16):
+                problems.append(f"tiles: rendering {size} bytes gives the wrong number of lines")
+        except Exception as e:
+            problems.append(f"tiles: {size} bytes: {type(e).__name__}: {e}")
+    return problems
+
+def check_rom(rom_path, manifest):
+    """
+    Decodes every compressed block in the manifest with decompress.py (decompress, iter_decompress
+    and BlockIndex) and the reference decoder, which must all agree. Then compresses the result
+    again and checks that it round trips. Returns a list of problems.
+    """
+    import extract
+    problems = []
+    with decompress.open_rom(rom_path) as rom:
+        for offset, kind, name, _ in extract.read_manifest(manifest):
+            if kind == 'raw':
+                continue
+            try:
+                decoded, consumed = decompress.decompress(rom, offset)
+            except ValueError as e:
+                problems.append(f"{name}: decompress.py: {e}")
+                continue
+            try:
+                reference, reference_consumed = reference_decompress(rom, offset)
+            except ValueError as e:
+                problems.append(f"{name}: reference decoder: {e}")
+                continue
+            if decoded != reference or consumed != reference_consumed:
+                problems.append(f"{name}: decompress.py and the reference decoder disagree")
+            elif decompress.BlockIndex(rom, offset).decompress_range(0, len(decoded)) != decoded:
+                problems.append(f"{name}: BlockIndex.decompress_range differs")
+            elif b''.join(decompress.iter_decompress(rom, offset)) != decoded:
+                problems.append(f"{name}: iter_decompress differs")
+            else:
+                problem = check(bytes(decoded), {'minimum_span': compress.MINIMUM_SPAN, 'optimal': True})
+                if problem:
+                    problems.append(f"{name}: compressing it again: {problem}")
+                else:
+                    print(f"{name}: {consumed} bytes -> {len(decoded)} bytes, decoders agree and it round trips")
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Round-trip fuzzing for compress.py and decompress.py.")
+    parser.add_argument('-n', '--cases', type=int, default=2000, help="number of generated inputs (default 2000)")
+    parser.add_argument('--seed', type=int, default=0, help="first seed; case n uses seed + n")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--rom', help="also check every compressed block of this ROM with both decoders")
+    parser.add_argument('--manifest', default=os.path.join(REPO_DIR, 'assets.txt'), help="blocks to check with --rom")
+    parser.add_argument('-o', '--output', default='fuzz_failures', help="where shrunk failing inputs are written")
+    args = parser.parse_args()
+
+    problems = check_tiles()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    failed = bool(problems)
+    if args.rom:
+        try:
+            problems = check_rom(args.rom, args.manifest)
+        except (IOError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        for problem in problems:
+            print(f"FAIL {problem}")
+        failed = failed or bool(problems)
+
+    seeds = list(range(args.seed, args.seed + args.cases))
+    batches = [seeds[i:i + 20] for i in range(0, len(seeds), 20)]
+    failures = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for done, batch_failures in enumerate(executor.map(run_cases, batches), 1):
+            failures.extend(batch_failures)
+            print(f"\r{min(done * 20, len(seeds))} of {len(seeds)} cases, {len(failures)} failed", end='', flush=True)
+        print()
+        shrunk = list(executor.map(shrink_failure, failures))
+
+    for (seed, strategy, problem), data in zip(failures, shrunk):
+        os.makedirs(args.output, exist_ok=True)
+        path = os.path.join(args.output, f"seed{seed}.bin")
+        with open(path, 'wb') as f:
+            f.write(data)
+        print(f"FAIL seed {seed} with {compress.describe_strategy(strategy)}: {problem}")
+        print(f"     shrunk to {len(data)} bytes in {path}: {check(data, strategy)}")
+    sys.exit(1 if failed or failures else 0)
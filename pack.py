@@ -0,0 +1,163 @@
+import os
+import sys
+import copy
+import mmap
+import struct
+import argparse
+
+import cache
+import build
+
+# Finds room for blocks that have outgrown their original place in the ROM. The space to work
+# with is every block's original slot plus the free regions listed in the build manifest.
+# A block stays where it is for as long as it fits there, so after an edit only the blocks that
+# grew out of their space are moved. Moving a block means changing the pointers to it, which are
+# found by searching the unmodified ROM for its address.
+
+ALIGNMENT = 2
+
+def merge(regions):
+    merged = []
+    for start, end in sorted(regions):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def subtract(regions, used):
+    """Returns the parts of regions (sorted, not overlapping) that aren't in used."""
+    result = []
+    used = merge(used)
+    for start, end in regions:
+        for used_start, used_end in used:
+            if used_end <= start or used_start >= end:
+                continue
+            if used_start > start:
+                result.append((start, used_start))
+            start = max(start, used_end)
+        if start < end:
+            result.append((start, end))
+    return result
+
+def find_padding(rom, fill=0xff, min_length=0x400):
+    """Runs of at least min_length fill bytes, which are often unused space. Check before using them."""
+    runs = []
+    pattern = bytes((fill,)) * min_length
+    position = rom.find(pattern)
+    while position >= 0:
+        end = position + min_length
+        while end < len(rom) and rom[end] == fill:
+            end += 1
+        runs.append((position, end))
+        position = rom.find(pattern, end)
+    return runs
+
+def find_pointers(rom, address):
+    """Positions of the big-endian 32-bit value address at even offsets, as the 68000 would read it."""
+    pattern = struct.pack('>I', address)
+    positions = []
+    position = rom.find(pattern)
+    while position >= 0:
+        if position % 2 == 0:
+            positions.append(position)
+        position = rom.find(pattern, position + 1)
+    return positions
+
+def place(free, size, home=None):
+    """Picks where a block of size bytes goes: its home if that's free, else the smallest free region it fits."""
+    if home is not None and any(start <= home and home + size <= end for start, end in free):
+        return home
+    best = None
+    for start, end in free:
+        start += start % ALIGNMENT
+        if start + size <= end and (best is None or end - start < best[1]):
+            best = (start, end - start)
+    return best and best[0]
+
+def plan(blocks, free_regions, state, rom):
+    """
+    Decides where each block goes. blocks is a list of (name, home offset, size of the home slot,
+    data) and state the packer's part of the build state, which is updated: 'placements' maps
+    each name to [offset, space reserved there], and 'pointers' to where the pointers to it are.
+    Returns ({name: offset}, list of (pointer position, new pointer bytes)).
+    Raises ValueError if a block can't be placed or has to move but no pointer to it is found.
+    """
+    placements = state.setdefault('placements', {})
+    pointers = state.setdefault('pointers', {})
+    names = {name for name, _, _, _ in blocks}
+    for name in list(placements):
+        if name not in names:
+            del placements[name]
+    for name, home, slot, _ in blocks:
+        placements.setdefault(name, [home, slot])
+
+    # Everything that outgrew its space gives it up, then gets placed again, biggest first.
+    moving = [block for block in blocks if len(block[3]) > placements[block[0]][1]]
+    previous = {name: placements.pop(name)[0] for name, _, _, _ in moving}
+    space = merge([(home, home + slot) for _, home, slot, _ in blocks] + list(free_regions))
+    free = subtract(space, [(offset, offset + size) for offset, size in placements.values()])
+    for name, home, slot, data in sorted(moving, key=lambda block: -len(block[3])):
+        offset = place(free, len(data), home)
+        if offset is None:
+            largest = max((end - start for start, end in free), default=0)
+            raise ValueError(f"No room for {name} ({len(data)} bytes); the largest free region is {largest} bytes.")
+        if offset != home and name not in pointers:
+            # Only ever searched for while the block is still at home, so the ROM is unmodified.
+            # Searched for before the block is placed, so a failure doesn't leave it moved.
+            found = find_pointers(rom, previous[name])
+            if not found:
+                raise ValueError(f"{name} has to move but no pointer to 0x{previous[name]:x} was found.")
+            pointers[name] = found
+        reserved = len(data) + len(data) % ALIGNMENT
+        if offset == home:
+            reserved = max(reserved, slot)
+        placements[name] = [offset, reserved]
+        free = subtract(free, [(offset, offset + reserved)])
+
+    changes = []
+    for name, home, _, _ in blocks:
+        offset = placements[name][0]
+        for position in pointers.get(name, []):
+            value = struct.pack('>I', offset)
+            if rom[position:position + 4] != value:
+                changes.append((position, value))
+    return {name: placement[0] for name, placement in placements.items()}, changes
+
+def print_plan(blocks, placements, state):
+    for name, home, slot, data in blocks:
+        offset = placements[name]
+        if offset == home:
+            print(f"{name}: {len(data)} bytes at home 0x{home:x} ({slot - len(data)} spare)")
+        else:
+            where = ', '.join(f"0x{p:x}" for p in state['pointers'].get(name, []))
+            print(f"{name}: {len(data)} bytes moved from 0x{home:x} to 0x{offset:x} (pointers at {where})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show where build.py --relocate would put each block, without changing anything.")
+    parser.add_argument('rom_path')
+    parser.add_argument('manifest', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build.txt'))
+    parser.add_argument('--build-dir', default='build', help="where built blocks and the build state are kept")
+    parser.add_argument('--find-padding', action='store_true',
+                        help="list runs of 0xff bytes that might be unused space")
+    args = parser.parse_args()
+
+    try:
+        entries = build.read_build_manifest(args.manifest)
+        free_regions = build.read_free_regions(args.manifest)
+        state = build.load_state(os.path.join(args.build_dir, 'state.json'))
+        with open(args.rom_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as rom:
+            if args.find_padding:
+                for start, end in find_padding(rom):
+                    print(f"free 0x{start:x} 0x{end:x}   # {end - start} bytes of 0xff")
+                sys.exit(0)
+            blocks, _ = build.build_blocks(entries, rom, state, args.build_dir, output_cache=cache.DiskCache('compressed'),
+                                            save=False)
+            pack_state = copy.deepcopy(state.get('pack', {}))
+            placements, changes = plan(blocks, free_regions, pack_state, rom)
+    except (IOError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print_plan(blocks, placements, pack_state)
+    print(f"{len(changes)} pointers would change.")
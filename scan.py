@@ -0,0 +1,111 @@
+import sys
+import os
+import mmap
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import decompress
+
+TILEMAP_SIZES = (4096, 8192)
+
+# Each worker process maps the ROM once and scans the ranges it is given from that view.
+worker_rom = None
+
+def open_worker_rom(rom_path):
+    global worker_rom
+    with open(rom_path, 'rb') as f:
+        worker_rom = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def classify(size, min_tiles_size):
+    if size in TILEMAP_SIZES:
+        return 'tilemap'
+    if size >= min_tiles_size and size % 32 == 0:
+        return 'tiles'
+    return None
+
+def scan_range(task):
+    start, end, min_tiles_size, keep_all = task
+    rom = worker_rom
+    measure = decompress.measure
+    found = []
+    for offset in range(start, end):
+        result = measure(rom, offset)
+        if result is None:
+            continue
+        size, consumed = result
+        kind = classify(size, min_tiles_size)
+        if kind is None and not keep_all:
+            continue
+        found.append((offset, consumed, size, kind))
+    return found
+
+def collapse(candidates):
+    """
+    A valid block usually has valid suffixes: starting partway through one of its commands
+    often parses to the same terminator. Keeps the earliest start for each end offset and drops
+    candidates that lie entirely inside a kept one. Each kept candidate gets a count of what it absorbed.
+    """
+    by_end = {}
+    for offset, consumed, size, kind in candidates:
+        end = offset + consumed
+        if end not in by_end or offset < by_end[end][0]:
+            absorbed = by_end[end][4] + 1 if end in by_end else 0
+            by_end[end] = [offset, consumed, size, kind, absorbed]
+        else:
+            by_end[end][4] += 1
+
+    kept = []
+    for candidate in sorted(by_end.values(), key=lambda c: (c[0], -c[1])):
+        if kept and candidate[0] + candidate[1] <= kept[-1][0] + kept[-1][1]:
+            kept[-1][4] += candidate[4] + 1
+            continue
+        kept.append(candidate)
+    return [tuple(c) for c in kept]
+
+def scan_rom(rom_path, start=0, end=None, jobs=None, min_tiles_size=64, keep_all=False):
+    """
+    Tests every offset in [start, end) for a compressed block that parses to a terminator.
+    Returns (offset, consumed, decompressed size, kind) tuples sorted by offset, where kind is
+    'tilemap', 'tiles' or None (only reported with keep_all).
+    """
+    if end is None:
+        end = os.path.getsize(rom_path)
+    jobs = jobs or os.cpu_count() or 1
+    # Several chunks per worker so a slow region doesn't hold up the whole scan.
+    chunk = max(1, -(-(end - start) // (jobs * 8)))
+    tasks = [(s, min(s + chunk, end), min_tiles_size, keep_all) for s in range(start, end, chunk)]
+    if jobs == 1:
+        open_worker_rom(rom_path)
+        results = map(scan_range, tasks)
+        return [c for found in results for c in found]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=open_worker_rom, initargs=(rom_path,)) as pool:
+        return [c for found in pool.map(scan_range, tasks) for c in found]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan a ROM for offsets that decompress to plausible tilemaps or tiles.",
+                                     epilog="Example: python scan.py dnd.md --start 0x50000 --end 0x60000")
+    parser.add_argument('rom_path')
+    parser.add_argument('--start', type=lambda x: int(x, 16), default=0, help="first offset to test (hex)")
+    parser.add_argument('--end', type=lambda x: int(x, 16), default=None, help="stop before this offset (hex)")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--min-tiles', type=int, default=2, help="smallest tile block to report, in tiles")
+    parser.add_argument('--all', action='store_true', help="report every block that parses, whatever its size")
+    parser.add_argument('--raw', action='store_true', help="don't collapse overlapping candidates")
+    args = parser.parse_args()
+
+    try:
+        candidates = scan_rom(args.rom_path, args.start, args.end, args.jobs, args.min_tiles * 32, args.all)
+    except IOError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.raw:
+        results = [c + (0,) for c in candidates]
+    else:
+        results = collapse(candidates)
+    for offset, consumed, size, kind, absorbed in results:
+        line = f"0x{offset:06x}: {kind or '?':<7} {size:6} bytes from {consumed:5} (ends at 0x{offset + consumed:06x})"
+        if absorbed:
+            line += f" +{absorbed} overlapping"
+        print(line)
+    print(f"{len(results)} candidates ({len(candidates)} before collapsing)")
@@ -1,17 +1,37 @@
 import struct
 import sys
-import os
+import argparse
+import assets
+import tiles
+
+# Bump whenever a change alters the sprite table or tileset produced for the same text.
+SPRITE_VERSION = 1
+
+FIRST_TILE = 0x03AF
+MAX_TILES = 93
+MAX_SPRITES = 28
+BLANK = '_' # Character used in @fontorder (and the text) for a blank tile
 
 filename = None
 fontoffset = 0
 fontorder = None
+compressed = None # Offset of a compressed block in @filename that holds the font, if it is one
 
-def generate_sprite_table_and_tiles_flexible_spaces(text_content):
+def reset_directives():
+    """Back to the defaults, so a text without a directive doesn't get the one from the text read before it."""
+    global filename, fontoffset, fontorder, compressed
+    filename = None
+    fontoffset = 0
+    fontorder = None
+    compressed = None
+
+def generate_sprite_table_and_tiles_flexible_spaces(text_content, verbose=True):
     """
     Generates a sprite table and ordered tileset string for Flow 1.
     Handles spaces dynamically for indentation and extra gaps.
     """
     
+    reset_directives()
     tileset_chars_list = [] 
     sprite_entries = []
     current_y = 0x0000
@@ -31,7 +51,11 @@ def generate_sprite_table_and_tiles_flexible_spaces(text_content):
             continue
         if processed_line.startswith('@fontoffset'):
             global fontoffset
-            fontoffset = int(processed_line.split('=', 1)[1].strip())
+            fontoffset = int(processed_line.split('=', 1)[1].strip(), 0)
+            continue
+        if processed_line.startswith('@compressed'):
+            global compressed
+            compressed = int(processed_line.split('=', 1)[1].strip(), 0)
             continue
         if processed_line.startswith('@fontorder'):
             global fontorder
@@ -100,24 +124,295 @@ def generate_sprite_table_and_tiles_flexible_spaces(text_content):
     # Summary
     tileset_string = "".join(tileset_chars_list)
     
-    print(f"\n--- Generation Summary (Flow 1: No Reuse, Flexible Spacing) ---")
-    print(f"Total tiles used in sequence: {len(tileset_string)}")
-    print(f"Total sprites generated: {len(sprite_entries)}")
+    if verbose:
+        print(f"\n--- Generation Summary (Flow 1: No Reuse, Flexible Spacing) ---")
+        print(f"Total tiles used in sequence: {len(tileset_string)}")
+        print(f"Total sprites generated: {len(sprite_entries)}")
     
-    if len(tileset_string) > 93:
-        print(f"Warning: Total tiles ({len(tileset_string)}) exceeds 93-tile limit.")
-    if len(sprite_entries) > 28:
-        print(f"Warning: Total sprites ({len(sprite_entries)}) exceeds 28-sprite limit.")
+        if len(tileset_string) > 93:
+            print(f"Warning: Total tiles ({len(tileset_string)}) exceeds 93-tile limit.")
+        if len(sprite_entries) > 28:
+            print(f"Warning: Total sprites ({len(sprite_entries)}) exceeds 28-sprite limit.")
         
     return sprite_entries, tileset_string
 
+def text_rows(text_content):
+    """
+    Reads the directives like generate_sprite_table_and_tiles_flexible_spaces does and returns
+    (y, line) for each line of text.
+    """
+    global filename, fontoffset, fontorder, compressed
+    reset_directives()
+    rows = []
+    current_y = 0x0000
+    for line in text_content.split('\n'):
+        if line.lstrip().startswith('#'):
+            continue
+        processed_line = line.split('#', 1)[0].rstrip().lower()
+        if processed_line.startswith('@filename'):
+            filename = processed_line.split('=', 1)[1].strip()
+        elif processed_line.startswith('@fontoffset'):
+            fontoffset = int(processed_line.split('=', 1)[1].strip(), 0)
+        elif processed_line.startswith('@compressed'):
+            compressed = int(processed_line.split('=', 1)[1].strip(), 0)
+        elif processed_line.startswith('@fontorder'):
+            fontorder = processed_line.split('=', 1)[1].strip()
+        else:
+            rows.append((current_y, processed_line))
+            current_y += 0x10
+    return rows
+
+def line_splits(line, allow_blank=True, slack=1, limit=2000):
+    """
+    Ways to cover the characters of a line with sprites 1-4 tiles wide, using at most slack more
+    sprites than the fewest possible. Each is a list of (column, tiles) with blank tiles as BLANK.
+    A sprite may span a gap (spaces or BLANK) when allow_blank is set.
+    """
+    blank = [char in (' ', BLANK) for char in line]
+    # fewest[i] is the fewest sprites that cover everything from column i on.
+    fewest = [0] * (len(line) + 1)
+    for i in range(len(line) - 1, -1, -1):
+        if blank[i]:
+            fewest[i] = fewest[i + 1]
+            continue
+        widths = [w for w in range(1, 5) if i + w <= len(line) and not blank[i + w - 1]
+                  and (allow_blank or not any(blank[i:i + w]))]
+        fewest[i] = 1 + min(fewest[i + w] for w in widths)
+
+    splits = []
+    def cover(i, used, sprites):
+        while i < len(line) and blank[i]:
+            i += 1
+        if i == len(line):
+            splits.append(list(sprites))
+            return
+        for w in range(4, 0, -1):
+            if len(splits) >= limit:
+                return
+            if i + w > len(line) or blank[i + w - 1] or (not allow_blank and any(blank[i:i + w])):
+                continue
+            if used + 1 + fewest[i + w] > fewest[0] + slack:
+                continue
+            sprites.append((i, line[i:i + w].replace(' ', BLANK)))
+            cover(i + w, used + 1, sprites)
+            sprites.pop()
+    cover(0, 0, [])
+    return splits
+
+_overlaps = {}
+
+def overlap(a, b):
+    """How many characters at the end of a the start of b can share."""
+    n = _overlaps.get((a, b))
+    if n is None:
+        n = next((n for n in range(min(len(a), len(b)) - 1, 0, -1) if a.endswith(b[:n])), 0)
+        _overlaps[(a, b)] = n
+    return n
+
+def superstring(pieces, in_order=False):
+    """
+    A short string containing every piece, so each sprite's tiles can be found in a row.
+    Pieces are chained greedily along the biggest overlaps, or with in_order, appended in turn
+    overlapping the end so far.
+    """
+    pieces = list(dict.fromkeys(pieces))
+    pieces = [p for p in pieces if not any(p != q and p in q for q in pieces)]
+    if in_order:
+        result = ''
+        for p in pieces:
+            if p not in result:
+                result += p[overlap(result, p):]
+        return result
+
+    edges = sorted(((overlap(a, b), i, j) for i, a in enumerate(pieces) for j, b in enumerate(pieces) if i != j),
+                   key=lambda edge: -edge[0])
+    following = {}
+    preceding = {}
+    last = list(range(len(pieces))) # last[first of a chain] is the end of that chain
+    first = list(range(len(pieces)))
+    for n, i, j in edges:
+        if n == 0:
+            break
+        if i in following or j in preceding or first[i] == j:
+            continue
+        preceding[j] = i
+        head, tail = first[i], last[j]
+        last[head] = tail
+        first[tail] = head
+        following[i] = (j, n)
+
+    result = ''
+    for i in range(len(pieces)):
+        if i in preceding:
+            continue
+        result += pieces[i]
+        while i in following:
+            i, n = following[i]
+            result += pieces[i][n:]
+    return result
+
+def sprite_layout(rows, choice, tileset_string):
+    sprite_entries = []
+    for (y, _), sprites in zip(rows, choice):
+        for column, run in sprites:
+            width = len(run)
+            start_tile_id = FIRST_TILE + tileset_string.find(run)
+            sprite_entries.append(struct.pack('>HHHH', y, (width - 1) << 10, start_tile_id, column * 8))
+    return sprite_entries
+
+def optimize_sprites(text_content, font_data=None, max_tiles=MAX_TILES, verbose=True):
+    """
+    Like generate_sprite_table_and_tiles_flexible_spaces, but shares tiles between sprites and
+    chooses where to split the text (including across spaces, using the BLANK tile) to use as few
+    sprites as possible while staying within max_tiles. With font_data (which needs @fontorder),
+    ties are broken by the compressed size of the tileset, otherwise by the number of tiles.
+    """
+    rows = text_rows(text_content)
+    allow_blank = fontorder is None or BLANK in fontorder
+    def pieces(choice):
+        return [run for sprites in choice for _, run in sprites]
+
+    def score(choice):
+        tile_count = len(superstring(pieces(choice)))
+        return (tile_count > max_tiles, sum(len(sprites) for sprites in choice), tile_count)
+
+    # Change one line at a time while that helps, starting from the fewest sprites on every line.
+    # Extra sprites can only pay off by saving tiles, so they are only tried if the tiles don't fit.
+    scored = {}
+    for slack in (0, 1):
+        options = [line_splits(line, allow_blank, slack) for _, line in rows]
+        choice = [tuple(splits[0]) for splits in options]
+        best = score(choice)
+        improved = True
+        while improved:
+            improved = False
+            for line, splits in enumerate(options):
+                for split in splits:
+                    candidate = choice[:line] + [tuple(split)] + choice[line + 1:]
+                    key = tuple(candidate)
+                    if key not in scored:
+                        scored[key] = score(candidate)
+                    if scored[key] < best:
+                        choice, best = candidate, scored[key]
+                        improved = True
+        if not best[0]:
+            break
+
+    if font_data is not None:
+        # Of the layouts that are as good, keep the one whose tileset compresses best.
+        import compress
+        finalists = sorted(key for key, value in scored.items() if value[:2] == best[:2] and value[2] <= best[2] + 2)
+        finalists = sorted(finalists, key=lambda key: scored[key])[:16]
+        best_size = None
+        for key in finalists:
+            for in_order in (False, True):
+                tileset_string = superstring(pieces(key), in_order)
+                if len(tileset_string) > max_tiles and best[0] == 0:
+                    continue
+                size = compress.estimate_size(build_tileset(tileset_string, font_data, fontorder, fontoffset))
+                if best_size is None or (size, len(tileset_string)) < best_size:
+                    best_size = (size, len(tileset_string))
+                    choice, chosen = list(key), tileset_string
+        tileset_string = chosen
+    else:
+        tileset_string = superstring(pieces(choice))
+
+    sprite_entries = sprite_layout(rows, choice, tileset_string)
+    if verbose:
+        print(f"\n--- Generation Summary (Optimized: Shared Tiles) ---")
+        print(f"Total tiles used in sequence: {len(tileset_string)}")
+        print(f"Total sprites generated: {len(sprite_entries)}")
+        if font_data is not None:
+            print(f"Compressed tileset size: {best_size[0]}")
+
+        if len(tileset_string) > max_tiles:
+            print(f"Warning: Total tiles ({len(tileset_string)}) exceeds {max_tiles}-tile limit.")
+        if len(sprite_entries) > MAX_SPRITES:
+            print(f"Warning: Total sprites ({len(sprite_entries)}) exceeds {MAX_SPRITES}-sprite limit.")
+
+    return sprite_entries, tileset_string
+
+def dedupe_sprites(sprite_entries, tileset, first_tile=FIRST_TILE, flip=True):
+    """
+    Rebuilds the tileset so that sprites showing the same tiles, or (with flip) a flipped copy
+    of them, share one copy, using the sprite's flip bits. A flipped sprite also shows its tiles
+    in reverse order, so the whole run of tiles has to match. Tiles no sprite uses are dropped.
+    Returns the new sprite entries and tileset, or the old ones if that isn't smaller.
+    """
+    H, V = tiles.FLIP_BITS[1], tiles.FLIP_BITS[2]
+    # Give every distinct tile (flipped ones included) a character so runs of tiles are strings
+    # and superstring() can lay them out.
+    codes = {}
+    variants = [[codes.setdefault(t, chr(0x100 + len(codes))) for t in tiles.split(v)] for v in tiles.flips(tileset)]
+    plain, hflipped, vflipped, both = variants
+
+    sprites = []
+    for entry in sprite_entries:
+        y, size, attribute, x = struct.unpack('>HHHH', entry)
+        width = ((size >> 10) & 3) + 1
+        length = width * (((size >> 8) & 3) + 1)
+        n = (attribute & 0x7ff) - first_tile
+        if n < 0 or n + length > len(plain):
+            raise ValueError(f"Sprite at {x}, {y} uses tiles that aren't in the tileset.")
+        runs = [(0, ''.join(plain[n:n + length]))]
+        if flip and length == width: # Only single row sprites
+            runs += [(H, ''.join(reversed(hflipped[n:n + length]))),
+                     (V, ''.join(vflipped[n:n + length])),
+                     (H | V, ''.join(reversed(both[n:n + length])))]
+        sprites.append((y, size, attribute, x, runs))
+
+    # Longest first, keep the runs that no kept run already contains, flipped or not.
+    kept = []
+    for runs in sorted((runs for *_, runs in sprites), key=lambda runs: -len(runs[0][1])):
+        if not any(run in k for _, run in runs for k in kept):
+            kept.append(runs[0][1])
+    tileset_string = superstring(kept)
+    if len(tileset_string) >= len(plain):
+        return list(sprite_entries), bytes(tileset)
+
+    new_entries = []
+    for y, size, attribute, x, runs in sprites:
+        bits, start = next((bits, tileset_string.find(run)) for bits, run in runs if run in tileset_string)
+        attribute = ((attribute & ~0x7ff) ^ bits) | (first_tile + start)
+        new_entries.append(struct.pack('>HHHH', y, size, attribute, x))
+    tile_data = {code: t for t, code in codes.items()}
+    return new_entries, b''.join(tile_data[code] for code in tileset_string)
+
+def load_font():
+    """
+    The font data named by the @filename and @compressed directives (through assets.py, so it is
+    only read once). Raises ValueError if there is no @filename.
+    """
+    if filename is None:
+        raise ValueError("No @filename directive names the font.")
+    if compressed is not None:
+        return assets.decompressed(filename, compressed)
+    return assets.read_file(filename)
+
+def build_tileset(tiles_needed_string, font_data, fontorder, fontoffset=0):
+    """Copies the 32-byte font tile for each character, in order. Raises ValueError for unknown characters."""
+    tileset = bytearray()
+    for tile in tiles_needed_string:
+        num = fontorder.find(tile)
+        if num < 0:
+            raise ValueError(f"The tile for '{tile}' was not found in @fontorder.")
+        tileset += tiles.tile(font_data, num, fontoffset)
+    return tileset
+
+def sprite_table_bytes(sprite_entries):
+    return b''.join(sprite_entries)
+
 # --- Main Execution Block ---
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(f"Usage: python {os.path.basename(sys.argv[0])} <input_text_file>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Generate the game over sprite table and tileset from text.")
+    parser.add_argument('input_text_file')
+    parser.add_argument('--optimize', action='store_true',
+                        help="share tiles between sprites and choose the splits that need the fewest sprites")
+    parser.add_argument('--dedupe', action='store_true',
+                        help="let sprites use flipped copies of each other's tiles")
+    args = parser.parse_args()
 
-    input_file_path = sys.argv[1] # Corrected index access
+    input_file_path = args.input_text_file
 
     try:
         with open(input_file_path, 'r') as f:
@@ -126,7 +421,26 @@ if __name__ == "__main__":
         print(f"Error: The file '{input_file_path}' was not found.")
         sys.exit(1)
 
-    sprite_data, tiles_needed_string = generate_sprite_table_and_tiles_flexible_spaces(file_content)
+    sprite_data, tiles_needed_string = generate_sprite_table_and_tiles_flexible_spaces(file_content, verbose=not args.optimize)
+
+    try:
+        font_data = load_font()
+    except FileNotFoundError:
+        print(f"Error: The file '{filename}' was not found.")
+        sys.exit(1)
+    except ValueError as e:
+        if filename is None or compressed is None:
+            print(f"Error: {e}")
+        else:
+            print(f"Error: No compressed font at 0x{compressed:x} in '{filename}': {e}")
+        sys.exit(1)
+
+    if args.optimize:
+        try:
+            sprite_data, tiles_needed_string = optimize_sprites(file_content, font_data)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
 
     print(f"\n--- Tileset Character Order (Spaces Skipped) ---")
     print(tiles_needed_string)
@@ -134,19 +448,17 @@ if __name__ == "__main__":
     print(f"\n--- Generating Tileset ---")
 
     try:
-        with open(filename, 'rb') as f:
-            tileset = f.read()
-    except FileNotFoundError:
-        print(f"Error: The file '{input_file_path}' was not found.")
+        tileset = build_tileset(tiles_needed_string, font_data, fontorder, fontoffset)
+    except ValueError as e:
+        print(f"Error: {e}")
         sys.exit(1)
 
+    if args.dedupe:
+        sprite_data, tileset = dedupe_sprites(sprite_data, tileset)
+        print(f"Tiles after removing repeated and flipped copies: {tiles.count(tileset)}")
+
     with open("tileset.bin", "wb") as f_out:
-        for tile in tiles_needed_string:
-             num = fontorder.find(tile)
-             if num < 0:
-                 print(f"Error: The tile for '{tile}' was not found in @fontorder.")
-                 sys.exit(1)
-             f_out.write(tileset[0x20*num:0x20*(num+1)])
+        f_out.write(tileset)
         print("Wrote output to tileset.bin")
         print("Compress with `python compress tileset.bin")
         print("Ensure compressed size is less than or equal to 0x1c0 (448)")
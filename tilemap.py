@@ -0,0 +1,126 @@
+import sys
+from array import array
+
+# A Genesis VDP tilemap: 64 columns by 32 (4096 bytes) or 64 (8192 bytes) rows of big-endian
+# words. Each word is priority (bit 15), palette (bits 13-14), vertical and horizontal flip
+# (bits 12 and 11) and the tile number (bits 0-10). The words are held in an array so rows
+# can be read, written and compared with slices instead of one cell at a time.
+
+WIDTH = 64
+HEIGHTS = (32, 64)
+
+TILE_MASK = 0x07ff
+HFLIP = 0x0800
+VFLIP = 0x1000
+PALETTE_SHIFT = 13
+PRIORITY = 0x8000
+
+# The high three bits of the tile number sit in the attribute byte.
+_TILE_HIGH = bytes(i & (TILE_MASK >> 8) for i in range(256))
+
+class Tilemap:
+    def __init__(self, height=32, words=None):
+        if height not in HEIGHTS:
+            raise ValueError(f"A tilemap is 32 or 64 rows, not {height}")
+        self.height = height
+        if words is None:
+            words = array('H', bytes(2 * WIDTH * height))
+        elif len(words) != WIDTH * height:
+            raise ValueError(f"A {WIDTH}x{height} tilemap needs {WIDTH * height} words, not {len(words)}")
+        self.words = words
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Reads the 4096 or 8192 byte big-endian form that the game (and decompress.py) uses."""
+        if len(data) % (2 * WIDTH) or len(data) // (2 * WIDTH) not in HEIGHTS:
+            raise ValueError(f"A tilemap is 4096 or 8192 bytes, not {len(data)}")
+        words = array('H', bytes(data))
+        if sys.byteorder == 'little':
+            words.byteswap()
+        return cls(len(data) // (2 * WIDTH), words)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+    def to_bytes(self):
+        words = self.words
+        if sys.byteorder == 'little':
+            words = array('H', words)
+            words.byteswap()
+        return words.tobytes()
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.to_bytes())
+
+    def copy(self):
+        return Tilemap(self.height, array('H', self.words))
+
+    def __eq__(self, other):
+        return isinstance(other, Tilemap) and self.words == other.words
+
+    def __getitem__(self, position):
+        x, y = position
+        return self.words[y * WIDTH + x]
+
+    def __setitem__(self, position, word):
+        x, y = position
+        self.words[y * WIDTH + x] = word
+
+    def row(self, y, x=0, width=None):
+        start = y * WIDTH + x
+        return self.words[start:start + (WIDTH - x if width is None else width)]
+
+    def set_row(self, y, x, words):
+        start = y * WIDTH + x
+        self.words[start:start + len(words)] = array('H', words)
+
+    def fill(self, word, x=0, y=0, width=WIDTH, height=None):
+        """Sets every cell of the rectangle to word."""
+        if height is None:
+            height = self.height - y
+        run = array('H', [word]) * width
+        for row in range(y, y + height):
+            self.words[row * WIDTH + x:row * WIDTH + x + width] = run
+
+    def attribute_bytes(self):
+        return self.to_bytes()[0::2]
+
+    def row_has_tiles(self, y):
+        """True if any cell of row y uses a tile other than tile 0."""
+        row = self.to_bytes()[2 * WIDTH * y:2 * WIDTH * (y + 1)]
+        return bool(row[1::2].strip(b'\0') or row[0::2].translate(_TILE_HIGH).strip(b'\0'))
+
+    def tile_ids(self):
+        """The tile number of every cell, row by row."""
+        data = self.to_bytes()
+        if not data[0::2].translate(_TILE_HIGH).strip(b'\0'):
+            return list(data[1::2])
+        return [word & TILE_MASK for word in self.words]
+
+    def remap_tiles(self, mapping, base=0):
+        """
+        Points the cells that use tiles base to base + len(mapping) - 1 at new tiles, where
+        mapping[n] is (new number, flip bits) for tile base + n, as from tiles.dedupe().
+        The flip bits are combined with any flip the cell already has.
+        """
+        words = self.words
+        for i, word in enumerate(words):
+            n = (word & TILE_MASK) - base
+            if 0 <= n < len(mapping):
+                number, flip = mapping[n]
+                words[i] = ((word & ~TILE_MASK) ^ flip) | (base + number)
+
+    def diff(self, other):
+        """Returns (x, y, word here, word in other) for every cell that differs."""
+        if other.height != self.height:
+            raise ValueError("Can't compare tilemaps of different heights")
+        changes = []
+        for y in range(self.height):
+            row, other_row = self.row(y), other.row(y)
+            if row == other_row:
+                continue
+            changes.extend((x, y, a, b) for x, (a, b) in enumerate(zip(row, other_row)) if a != b)
+        return changes
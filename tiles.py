@@ -0,0 +1,124 @@
+import hashlib
+from array import array
+
+# Genesis tiles are 8x8 pixels at four bits per pixel: 32 bytes, four bytes per row, with the left
+# pixel of each pair in the high nibble. Everything here works on whole buffers with translate,
+# slices and array operations, so no Python code runs per pixel.
+
+TILE_SIZE = 0x20
+ROW_SIZE = 4
+
+# Flip bits of tilemap and sprite attribute words, in the order flips() returns the variants.
+FLIP_BITS = (0x0000, 0x0800, 0x1000, 0x1800)
+
+_HIGH = bytes(i >> 4 for i in range(256))
+_LOW = bytes(i & 0x0f for i in range(256))
+_SHIFT = bytes((i << 4) & 0xff for i in range(256))
+_SWAP = bytes(((i << 4) & 0xf0) | (i >> 4) for i in range(256))
+_HEX = b'0123456789abcdef' + b'?' * 240
+
+# An array type with four-byte items, to handle a row of a tile at a time.
+_ROW_TYPE = next(code for code in 'IL' if array(code).itemsize == ROW_SIZE)
+
+def count(data):
+    return len(data) // TILE_SIZE
+
+def tile(data, number, offset=0):
+    """A view of tile number in data (no copy). Raises ValueError if the tile is past the end."""
+    start = offset + TILE_SIZE * number
+    if number < 0 or start + TILE_SIZE > len(data):
+        raise ValueError(f"Tile {number} at 0x{start:x} is past the end of the data.")
+    return memoryview(data)[start:start + TILE_SIZE]
+
+def split(data):
+    """Each tile as bytes, which can be used as a dictionary key."""
+    data = bytes(data)
+    return [data[i:i + TILE_SIZE] for i in range(0, count(data) * TILE_SIZE, TILE_SIZE)]
+
+def unpack(data):
+    """
+    Unpacks tiles to one byte per pixel. Returns an N x 8 x 8 memoryview, so
+    pixels[n, y, x] is the colour index of pixel x, y of tile n. With less than one whole tile
+    it is an empty one-dimensional view, as memoryview has no shape with a zero in it.
+    """
+    data = bytes(data[:count(data) * TILE_SIZE])
+    pixels = bytearray(2 * len(data))
+    pixels[0::2] = data.translate(_HIGH)
+    pixels[1::2] = data.translate(_LOW)
+    if not pixels:
+        return memoryview(pixels)
+    return memoryview(pixels).cast('B', (count(data), 8, 8))
+
+def pack(pixels):
+    """Packs one byte per pixel (any buffer of whole tiles, such as unpack() gives) back to 4bpp."""
+    pixels = bytes(memoryview(pixels).cast('B'))
+    if len(pixels) % (2 * TILE_SIZE):
+        raise ValueError(f"{len(pixels)} pixels is not a whole number of 8x8 tiles.")
+    if pixels.translate(_LOW) != pixels:
+        raise ValueError("Pixel values must be 0-15.")
+    high = int.from_bytes(pixels[0::2].translate(_SHIFT), 'big')
+    low = int.from_bytes(pixels[1::2], 'big')
+    return (high | low).to_bytes(len(pixels) // 2, 'big')
+
+def hflip(data):
+    """Mirrors every tile left to right."""
+    rows = array(_ROW_TYPE, bytes(data[:count(data) * TILE_SIZE]).translate(_SWAP))
+    rows.byteswap() # Reverses the four bytes of each row
+    return rows.tobytes()
+
+def vflip(data):
+    """Mirrors every tile top to bottom."""
+    rows = array(_ROW_TYPE, bytes(data[:count(data) * TILE_SIZE]))
+    flipped = array(_ROW_TYPE, rows)
+    for y in range(8):
+        flipped[y::8] = rows[7 - y::8]
+    return flipped.tobytes()
+
+def flips(data):
+    """The tiles as they are, flipped horizontally, vertically and both, in the order of the tilemap flip bits."""
+    h = hflip(data)
+    return [bytes(data[:count(data) * TILE_SIZE]), h, vflip(data), vflip(h)]
+
+def tile_hashes(data):
+    """A stable 64-bit hash of each tile's contents."""
+    return [int.from_bytes(hashlib.blake2b(t, digest_size=8).digest(), 'big') for t in split(data)]
+
+def unique(data):
+    """
+    Removes repeated tiles. Returns (the unique tiles in order of first use, and for each tile
+    in data the number of its copy among the unique ones).
+    """
+    numbers = {}
+    order = [numbers.setdefault(t, len(numbers)) for t in split(data)]
+    return b''.join(numbers), order
+
+def dedupe(data, flip=True):
+    """
+    Removes tiles that repeat an earlier tile, or (with flip) are a flipped copy of one.
+    Returns (the remaining tiles, and for each tile in data (its number among the remaining
+    tiles, the flip bits that turn that tile back into it)).
+    """
+    variants = [split(v) for v in (flips(data) if flip else [data])]
+    index = {} # tile (or flipped tile) -> (number, flip bits)
+    kept = []
+    mapping = []
+    for i, t in enumerate(variants[0]):
+        found = index.get(t)
+        if found is None:
+            found = (len(kept), 0)
+            for bits, variant in zip(FLIP_BITS, variants):
+                index.setdefault(variant[i], (len(kept), bits))
+            kept.append(t)
+        mapping.append(found)
+    return b''.join(kept), mapping
+
+def render(data, columns=16):
+    """The tiles as lines of hex digits, one character per pixel and columns tiles across."""
+    pixels = unpack(data).tobytes().translate(_HEX).decode('ascii')
+    lines = []
+    for first in range(0, count(data), columns):
+        last = min(first + columns, count(data))
+        for y in range(8):
+            lines.append(' '.join(pixels[64 * n + 8 * y:64 * n + 8 * y + 8] for n in range(first, last)))
+        lines.append('')
+    return lines